@@ -0,0 +1,139 @@
+"""
+Time startup history loading: the old full, ascending load against the
+paginated tail load. Runs on an in-process stand-in that walks a sorted
+(session_id, timestamp) index the way Mongo does. mongomock is not an option:
+it scans and copies every document on each query whatever the limit, so its
+timings say nothing about this comparison.
+
+    python benchmarks/bench_history_startup.py --messages 50000 --tail 200
+"""
+import argparse
+import bisect
+import copy
+import os
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from history_loader import HistoryPager
+
+
+class IndexedCursor:
+    def __init__(self, coll, query, projection):
+        self.coll = coll
+        self.query = query
+        self.projection = projection
+        self.direction = 1
+        self.limit_count = 0
+
+    def sort(self, key, direction):
+        assert key == "timestamp"
+        self.direction = direction
+        return self
+
+    def limit(self, count):
+        self.limit_count = count
+        return self
+
+    def _matches(self, doc):
+        for key, cond in self.query.items():
+            value = doc
+            for part in key.split("."):
+                value = value.get(part) if isinstance(value, dict) else None
+            if isinstance(cond, dict):
+                if "$ne" in cond and value == cond["$ne"]:
+                    return False
+                if "$lt" in cond and not value < cond["$lt"]:
+                    return False
+            elif value != cond:
+                return False
+        return True
+
+    def _project(self, doc):
+        if not self.projection:
+            return copy.deepcopy(doc)
+        return {k: copy.deepcopy(doc[k]) for k, v in self.projection.items() if v and k in doc}
+
+    def __iter__(self):
+        keys = self.coll.keys
+        session = self.query["session_id"]
+        lo = bisect.bisect_left(keys, (session, float("-inf")))
+        upper = self.query.get("timestamp", {}).get("$lt", float("inf"))
+        hi = bisect.bisect_left(keys, (session, upper))
+        positions = range(lo, hi) if self.direction == 1 else range(hi - 1, lo - 1, -1)
+        returned = 0
+        for pos in positions:
+            doc = self.coll.docs[pos]
+            if self._matches(doc):
+                yield self._project(doc)
+                returned += 1
+                if self.limit_count and returned >= self.limit_count:
+                    return
+
+
+class IndexedCollection:
+    """Just enough of a pymongo collection, kept sorted on (session_id, timestamp)."""
+
+    def __init__(self):
+        self.keys = []
+        self.docs = []
+
+    def insert_many(self, docs):
+        for doc in docs:
+            key = (doc["session_id"], doc["timestamp"])
+            pos = bisect.bisect_right(self.keys, key)
+            self.keys.insert(pos, key)
+            self.docs.insert(pos, doc)
+
+    def create_index(self, *args, **kwargs):
+        pass
+
+    def find(self, query, projection=None):
+        return IndexedCursor(self, query, projection)
+
+
+def populate(coll, session_id, count):
+    start = time.time() - count
+    docs = []
+    for i in range(count):
+        role = "user" if i % 2 == 0 else "assistant"
+        content = ("The Streets of Seringale. " * 30) if role == "user" else '{"journal": "walked", "game_input": "n"}'
+        docs.append({"session_id": session_id, "timestamp": start + i, "message": {"role": role, "content": content}})
+    coll.insert_many(docs)
+    coll.create_index([("session_id", 1), ("timestamp", 1)])
+
+
+def full_load(coll, session_id):
+    msgs = list(coll.find({"session_id": session_id}).sort("timestamp", 1))
+    return [m['message'] for m in msgs]
+
+
+def measure(label, fn):
+    tracemalloc.start()
+    started = time.perf_counter()
+    result = fn()
+    elapsed = time.perf_counter() - started
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    print(f"{label:>10}: {len(result):>7} messages in {elapsed * 1000:8.1f} ms, peak {peak / 1e6:7.1f} MB")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--messages', type=int, default=20000)
+    parser.add_argument('--tail', type=int, default=200)
+    args = parser.parse_args()
+
+    coll = IndexedCollection()
+    populate(coll, "bench", args.messages)
+
+    measure("full", lambda: full_load(coll, "bench"))
+    pager = HistoryPager(coll, "bench", page_size=args.tail)
+    measure("tail", lambda: pager.load_tail())
+    measure("next page", pager.older_page)
+
+
+if __name__ == '__main__':
+    main()
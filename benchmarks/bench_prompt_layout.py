@@ -0,0 +1,132 @@
+"""
+Compare the legacy and stable prompt layouts against a local mock of Ollama's
+/api/chat that models a single-slot prompt-prefix cache: prefill time is
+proportional to the bytes after the longest prefix shared with the previous
+request. The context window runs at the client's default token budget, with
+screens large enough that older turns have to be folded to fit it.
+
+    python benchmarks/bench_prompt_layout.py --turns 60
+"""
+import argparse
+import json
+import os
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import requests
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from context_window import CHARS_PER_TOKEN, ContextWindow
+from prompt_layout import LAYOUT_LEGACY, LAYOUT_STABLE, system_prompt_for, finalize_messages, request_options
+
+# Same default as mud_client.py, which cannot be imported here (it connects to Mongo)
+CONTEXT_TOKEN_BUDGET = int(os.getenv('CONTEXT_TOKEN_BUDGET', '8000'))
+
+
+class MockOllama:
+    def __init__(self, prefill_bytes_per_sec):
+        self.prefill_bytes_per_sec = prefill_bytes_per_sec
+        self.last_prompt = ""
+        self.prefill_bytes = 0
+        self.prompt_bytes = 0
+        self.lock = threading.Lock()
+
+    def prefill(self, messages):
+        prompt = "".join(f"<{m['role']}>{m['content']}" for m in messages)
+        with self.lock:
+            cached = len(os.path.commonprefix([self.last_prompt, prompt]))
+            self.last_prompt = prompt
+            uncached = len(prompt.encode('utf-8')) - len(prompt[:cached].encode('utf-8'))
+            self.prefill_bytes += uncached
+            self.prompt_bytes += len(prompt.encode('utf-8'))
+        time.sleep(uncached / self.prefill_bytes_per_sec)
+
+
+def make_handler(mock):
+    class Handler(BaseHTTPRequestHandler):
+        def do_POST(self):
+            body = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+            mock.prefill(body['messages'])
+            content = json.dumps({"journal": "j", "reasoning": "r", "decision": "d", "game_input": "look"})
+            reply = json.dumps({"message": {"role": "assistant", "content": content}, "done": True}).encode('utf-8')
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(reply)))
+            self.end_headers()
+            self.wfile.write(reply)
+
+        def log_message(self, *args):
+            pass
+    return Handler
+
+
+def screen(turn, tokens):
+    room = f"The Streets of Seringale ({turn % 7})"
+    sentence = "Cobblestones stretch out beneath worn shop signs. "
+    repeats = max(1, tokens * CHARS_PER_TOKEN // len(sentence))
+    return (f"{room}\n" + sentence * repeats
+            + f"\n[Exits: north east south]\n<{100 - turn % 10}hp 80m 120mv> >> ")
+
+
+def run_layout(layout, url, turns, base_prompt, goal, mock, budget, screen_tokens):
+    mock.last_prompt = ""
+    mock.prefill_bytes = 0
+    mock.prompt_bytes = 0
+    window = ContextWindow(token_budget=budget)
+    history = []
+    memories = []
+    ttfts = []
+    for turn in range(turns):
+        system_prompt = system_prompt_for(layout, base_prompt, memories, goal)
+        if not history:
+            history.append({"role": "system", "content": system_prompt})
+        else:
+            history[0]["content"] = system_prompt
+        history.append({"role": "user", "content": screen(turn, screen_tokens)})
+        messages = finalize_messages(layout, window.build(history), memories, goal)
+        options, extra = request_options(layout)
+        payload = {"model": "mock", "messages": messages, "options": options, "stream": False, **extra}
+        started = time.perf_counter()
+        response = requests.post(url, data=json.dumps(payload), stream=True)
+        next(response.iter_content(1))
+        ttfts.append(time.perf_counter() - started)
+        response.close()
+        history.append({"role": "assistant", "content": json.dumps({"journal": f"turn {turn}", "game_input": "look"})})
+        memories = (memories + [f"turn {turn}: walked the streets"])[-5:]
+    return mock.prefill_bytes, mock.prompt_bytes, ttfts
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--turns', type=int, default=40)
+    parser.add_argument('--prefill-rate', type=float, default=200_000, help='simulated prefill bytes per second')
+    parser.add_argument('--budget', type=int, default=CONTEXT_TOKEN_BUDGET, help='context token budget')
+    parser.add_argument('--screen-tokens', type=int, default=500, help='approximate tokens of game output per turn')
+    args = parser.parse_args()
+
+    base_prompt = "You are playing a live online MUD game. " + "Command reference line. " * 150
+    goal = "Navigate the streets of Seringale to locate the Trading Post."
+
+    mock = MockOllama(args.prefill_rate)
+    server = ThreadingHTTPServer(('127.0.0.1', 0), make_handler(mock))
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    url = f"http://127.0.0.1:{server.server_address[1]}/api/chat"
+
+    try:
+        for layout in (LAYOUT_LEGACY, LAYOUT_STABLE):
+            prefill_bytes, prompt_bytes, ttfts = run_layout(
+                layout, url, args.turns, base_prompt, goal, mock, args.budget, args.screen_tokens
+            )
+            ttfts.sort()
+            print(f"{layout:>7}: prefill {prefill_bytes:>9} bytes ({1 - prefill_bytes / prompt_bytes:4.0%} cached) | "
+                  f"TTFT mean {sum(ttfts) / len(ttfts) * 1000:7.1f} ms, "
+                  f"p50 {ttfts[len(ttfts) // 2] * 1000:7.1f} ms, max {ttfts[-1] * 1000:7.1f} ms")
+    finally:
+        server.shutdown()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,413 @@
+"""
+Replay recorded sessions through the full client, offline. A local telnet
+server plays back the screens of session logs (or a synthetic session
+when none are given), a local /api/chat answers with configurable latency and
+a share of malformed replies, and Mongo is replaced by an in-process
+collection. mud_client.main() runs end to end against them and the run
+reports turn latency, bytes sent to the LLM, DB writes per turn and the JSON
+parse-failure rate.
+
+    python benchmarks/bench_replay.py --logs 'logs/*_mud_log_*.txt' --latency 0.2 --malformed-rate 0.1
+    python benchmarks/bench_replay.py --no-stream --turns 40 --malformed-rate 0.3
+"""
+import argparse
+import asyncio
+import contextlib
+import copy
+import glob
+import json
+import os
+import random
+import re
+import shutil
+import sys
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, ROOT)
+
+from session_log import INDEX_SUFFIX, iter_lines
+
+USERNAME = 'bench'
+PASSWORD = 'bench'
+# Lines run_game writes to the log that are not game output
+CLIENT_LINE_PATTERN = re.compile(r'^(?:AI (?:reasoning|input|journal): |Reflex input \()')
+
+
+# ------------------------------ sessions ------------------------------
+def log_lines(path):
+    if path.endswith(INDEX_SUFFIX):
+        yield from iter_lines(path)
+        return
+    with open(path, 'r', encoding='utf-8', errors='ignore') as f:
+        yield from f
+
+
+def parse_log(path):
+    """
+    Split a session log, single-file or segmented (pass its .index.jsonl), into
+    the screens the server sent, each ending at a prompt.
+    """
+    screens = []
+    current = []
+    in_header = False
+    for number, line in enumerate(log_lines(path)):
+        line = line.rstrip('\r\n')
+        if number == 0 and line.startswith('# Environment'):
+            in_header = True
+        if in_header:
+            in_header = bool(line)
+            continue
+        if CLIENT_LINE_PATTERN.match(line):
+            continue
+        current.append(line)
+        if line.rstrip().endswith('>>'):
+            screens.append('\r\n'.join(current) + ' ')
+            current = []
+    return screens
+
+
+def synthetic_session(turns, seed=0):
+    rng = random.Random(seed)
+    rooms = [
+        ("The Dancing Girl Inn", "A cozy inn filled with the smell of ale and roasting meat.", "north east"),
+        ("The Streets of Seringale", "Cobblestones stretch away between tall stone houses.", "north south west"),
+        ("Temple Square", "A wide square before the great temple of the city.", "south east up"),
+        ("The Market", "Merchants shout their prices from crowded stalls.", "west north"),
+    ]
+    chatter = ["Bob gossips: anyone selling a sword?", "You are hungry.", "The sun rises in the east."]
+    screens = []
+    for turn in range(turns):
+        name, desc, exits = rooms[rng.randrange(len(rooms))]
+        lines = [name, desc + " " + desc, f"[Exits: {exits}]"]
+        if rng.random() < 0.3:
+            lines.append(rng.choice(chatter))
+        if rng.random() < 0.15:
+            lines.append("A goblin attacks you! You are fighting.")
+        hp = 100 - rng.randrange(30)
+        lines.append(f"<{hp}hp 80m 120mv> >>")
+        screens.append('\r\n'.join(lines) + ' ')
+    return screens
+
+
+# ------------------------------ fake MUD ------------------------------
+class ReplayServer:
+    """Telnet server that logs the client in, then sends one screen per command received."""
+
+    def __init__(self, screens, reply_timeout):
+        self.screens = screens
+        self.reply_timeout = reply_timeout
+        self.latencies = []
+        self.no_reply = 0
+        self.done = threading.Event()
+        self.port = None
+        self._started = threading.Event()
+
+    def start(self):
+        threading.Thread(target=lambda: asyncio.run(self._serve()), daemon=True).start()
+        self._started.wait()
+
+    async def _serve(self):
+        server = await asyncio.start_server(self._handle, '127.0.0.1', 0)
+        self.port = server.sockets[0].getsockname()[1]
+        self._started.set()
+        async with server:
+            await server.serve_forever()
+
+    async def _read_command(self, reader, timeout):
+        line = await asyncio.wait_for(reader.readline(), timeout)
+        if not line:
+            raise ConnectionError("client went away")
+        return line.decode('utf-8', errors='ignore').strip()
+
+    async def _handle(self, reader, writer):
+        try:
+            writer.write(b"Welcome to the replay.\r\nBy what name do you wish to be known? ")
+            await writer.drain()
+            while await self._read_command(reader, 10) != USERNAME:
+                pass
+            writer.write(b"Password: ")
+            await writer.drain()
+            await self._read_command(reader, 10)
+            for screen in self.screens:
+                writer.write(screen.encode('utf-8'))
+                await writer.drain()
+                sent_at = time.perf_counter()
+                try:
+                    await self._read_command(reader, self.reply_timeout)
+                except asyncio.TimeoutError:
+                    self.no_reply += 1  # Deferred by a reflex, or the client stalled
+                    continue
+                self.latencies.append(time.perf_counter() - sent_at)
+        except (ConnectionError, asyncio.TimeoutError):
+            pass
+        finally:
+            writer.close()
+            self.done.set()
+
+
+# ----------------------------- fake Ollama -----------------------------
+REPLY_FIELDS = {"journal": "Replaying a recorded session.", "reasoning": "Keep exploring.", "decision": "Look around."}
+COMMANDS = ["look", "north", "south", "east", "west", "score", "inventory"]
+
+
+def malformed(content, rng):
+    """Variants clean_llm_json or the streaming parser are meant to cope with."""
+    return rng.choice([
+        lambda c: "```json\n" + c + "\n```",
+        lambda c: "{{" + c + "}}",
+        lambda c: "'" + c + "'",
+        lambda c: c.replace('"', "'"),
+        lambda c: c[:c.index('"journal"') + 20],  # Truncated mid-journal, the last field in the schema
+    ])(content)
+
+
+class FakeOllama:
+    def __init__(self, latency, jitter, malformed_rate, seed):
+        self.latency = latency
+        self.jitter = jitter
+        self.malformed_rate = malformed_rate
+        self.rng = random.Random(seed)
+        self.lock = threading.Lock()
+        self.requests = 0
+        self.request_bytes = 0
+        self.malformed = 0
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), self._handler())
+        self.url = f"http://127.0.0.1:{self.server.server_address[1]}/api/chat"
+
+    def start(self):
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def reply(self, body):
+        with self.lock:
+            self.requests += 1
+            command = self.rng.choice(COMMANDS)
+            broken = self.rng.random() < self.malformed_rate
+            if broken:
+                self.malformed += 1
+            delay = max(0.0, self.latency + self.rng.uniform(-self.jitter, self.jitter))
+        # Fields in the order of the request's schema, as Ollama's grammar emits them
+        fields = {"game_input": command, **REPLY_FIELDS}
+        order = list(((body.get('format') or {}).get('properties') or {}).keys()) or list(fields)
+        content = json.dumps({key: fields.get(key, "") for key in order})
+        if broken:
+            with self.lock:
+                content = malformed(content, self.rng)
+        return content, delay
+
+    def _handler(self):
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                raw = self.rfile.read(int(self.headers['Content-Length']))
+                with fake.lock:
+                    fake.request_bytes += len(raw)
+                body = json.loads(raw)
+                content, delay = fake.reply(body)
+                done = {"done": True, "eval_count": len(content) // 4, "prompt_eval_count": len(raw) // 4}
+                if not body.get('stream'):
+                    time.sleep(delay)
+                    reply = json.dumps({"message": {"role": "assistant", "content": content}, **done}).encode('utf-8')
+                    self.send_response(200)
+                    self.send_header("Content-Type", "application/json")
+                    self.send_header("Content-Length", str(len(reply)))
+                    self.end_headers()
+                    self.wfile.write(reply)
+                    return
+                self.send_response(200)
+                self.send_header("Content-Type", "application/x-ndjson")
+                self.end_headers()
+                pieces = [content[i:i + 8] for i in range(0, len(content), 8)]
+                for piece in pieces:
+                    time.sleep(delay / len(pieces))
+                    self.wfile.write((json.dumps({"message": {"content": piece}, "done": False}) + "\n").encode('utf-8'))
+                    self.wfile.flush()
+                self.wfile.write((json.dumps({"message": {"content": ""}, **done}) + "\n").encode('utf-8'))
+
+            def log_message(self, *args):
+                pass
+        return Handler
+
+
+# ----------------------------- fake Mongo -----------------------------
+class MemoryCursor:
+    def __init__(self, docs):
+        self.docs = docs
+
+    def sort(self, key, direction):
+        self.docs = sorted(self.docs, key=lambda d: d.get(key, 0), reverse=direction < 0)
+        return self
+
+    def limit(self, count):
+        if count:
+            self.docs = self.docs[:count]
+        return self
+
+    def __iter__(self):
+        return iter(self.docs)
+
+
+class MemoryCollection:
+    """In-process stand-in for the pymongo calls the client makes, counting writes."""
+
+    def __init__(self):
+        self.docs = []
+        self.insert_calls = 0
+        self.docs_written = 0
+
+    @staticmethod
+    def _matches(doc, query):
+        for key, cond in query.items():
+            value = doc
+            for part in key.split('.'):
+                value = value.get(part) if isinstance(value, dict) else None
+            if isinstance(cond, dict):
+                if '$ne' in cond and value == cond['$ne']:
+                    return False
+                if '$lt' in cond and (value is None or not value < cond['$lt']):
+                    return False
+            elif value != cond:
+                return False
+        return True
+
+    @staticmethod
+    def _project(doc, projection):
+        if not projection:
+            return copy.deepcopy(doc)
+        return {k: copy.deepcopy(doc[k]) for k, v in projection.items() if v and k in doc}
+
+    def create_index(self, *args, **kwargs):
+        pass
+
+    def insert_many(self, docs, ordered=True):
+        docs = list(docs)
+        self.insert_calls += 1
+        self.docs_written += len(docs)
+        self.docs.extend(copy.deepcopy(docs))
+
+    def find(self, query, projection=None):
+        return MemoryCursor([self._project(d, projection) for d in self.docs if self._matches(d, query)])
+
+    def find_one(self, query, projection=None):
+        for doc in self.docs:
+            if self._matches(doc, query):
+                return self._project(doc, projection)
+        return None
+
+    def update_one(self, query, update, upsert=False):
+        if self.find_one(query) is None and upsert:
+            self.insert_calls += 1
+            self.docs_written += 1
+            self.docs.append({**query, **update.get('$setOnInsert', {})})
+
+
+# ------------------------------ the run ------------------------------
+class PressEnter:
+    """stdin for the client's "Press Enter to retry" prompt after an unusable reply."""
+
+    def readline(self):
+        return '\n'
+
+
+def percentile(values, pct):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))]
+
+
+def run(screens, args):
+    mud = ReplayServer(screens, reply_timeout=args.latency * 4 + 5)
+    mud.start()
+    ollama = FakeOllama(args.latency, args.jitter, args.malformed_rate, args.seed)
+    ollama.start()
+
+    workdir = tempfile.mkdtemp(prefix='bench_replay_')
+    os.chdir(workdir)
+    os.environ.update({
+        'MUD_HOST': '127.0.0.1', 'MUD_PORT': str(mud.port), 'MUD_USERNAME': USERNAME, 'MUD_PASSWORD': PASSWORD,
+        'OLLAMA_API_URL': ollama.url, 'LLM_STREAM': '1' if args.stream else '0', 'PROMPT_LAYOUT': args.layout,
+        'MONGO_SPILL_PATH': os.path.join(workdir, 'spill.jsonl'), 'AI_STATE_MODE': 'off',
+        'MEMORY_EMBEDDER': 'hashing', 'REFLEX_RULES_PATH': os.path.join(workdir, 'reflexes.json'),
+        'WORLD_MAP_PATH': os.path.join(workdir, 'world_map.json'),
+    })
+    import mud_client
+
+    history = MemoryCollection()
+    summaries = MemoryCollection()
+    mud_client.coll = history
+    mud_client.history_writer.coll = history
+    mud_client.summary_coll = summaries
+
+    error = None
+    started = time.perf_counter()
+    output = sys.stdout if args.verbose else open(os.devnull, 'w')
+    stdin = sys.stdin
+    sys.stdin = PressEnter()
+    with contextlib.redirect_stdout(output):
+        try:
+            mud_client.main()
+        except Exception as e:  # An unrecoverable reply ends run_game; report it with the numbers so far
+            error = e
+            mud_client.stop_shared_services()
+    sys.stdin = stdin
+    elapsed = time.perf_counter() - started
+    os.chdir(ROOT)
+    shutil.rmtree(workdir, ignore_errors=True)
+
+    turns = len(mud.latencies)
+    llm_turns = max(ollama.requests, 1)
+    print(f"screens replayed : {turns + mud.no_reply} ({mud.no_reply} without a reply) in {elapsed:.1f}s")
+    print(f"turn latency     : p50 {percentile(mud.latencies, 50) * 1000:.0f} ms, "
+          f"p99 {percentile(mud.latencies, 99) * 1000:.0f} ms")
+    print(f"LLM requests     : {ollama.requests} ({ollama.requests / max(turns, 1):.0%} of turns)")
+    print(f"bytes to LLM     : {ollama.request_bytes} total, {ollama.request_bytes / llm_turns:.0f} per request")
+    print(f"DB writes        : {history.docs_written + summaries.docs_written} docs in "
+          f"{history.insert_calls + summaries.insert_calls} calls, "
+          f"{(history.docs_written + summaries.docs_written) / max(turns, 1):.2f} docs per turn")
+    session = mud_client.default_character.session_id
+    repairs = mud_client.metrics.counter('json_repairs_total', session=session)
+    failures = mud_client.metrics.counter('parse_failures_total', session=session)
+    print(f"parse failures   : {failures:g}/{ollama.requests} ({failures / llm_turns:.0%}), "
+          f"{repairs:g} repaired; {ollama.malformed} malformed replies served")
+    if error is not None:
+        print(f"run aborted      : {type(error).__name__}: {error}")
+    return percentile(mud.latencies, 99), error
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--logs', default='*_mud_log_*', help='glob of session logs (.txt or .index.jsonl) to replay')
+    parser.add_argument('--turns', type=int, default=100, help='maximum screens to replay')
+    parser.add_argument('--latency', type=float, default=0.1, help='fake LLM reply time in seconds')
+    parser.add_argument('--jitter', type=float, default=0.02)
+    parser.add_argument('--malformed-rate', type=float, default=0.1)
+    parser.add_argument('--layout', default='legacy', choices=['legacy', 'stable'])
+    parser.add_argument('--no-stream', dest='stream', action='store_false')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--fail-p99', type=float, default=0.0, help='exit non-zero if p99 latency exceeds this many ms')
+    parser.add_argument('--verbose', action='store_true', help="show the client's own output")
+    args = parser.parse_args()
+
+    screens = []
+    for path in sorted(glob.glob(args.logs)):
+        if path.endswith(('.txt', INDEX_SUFFIX)):
+            screens.extend(parse_log(path))
+    source = f"{args.logs}"
+    if not screens:
+        screens = synthetic_session(args.turns, args.seed)
+        source = "synthetic session"
+    screens = screens[:args.turns]
+    print(f"Replaying {len(screens)} screens from {source}")
+
+    p99, error = run(screens, args)
+    if error is not None or (args.fail_p99 and p99 * 1000 > args.fail_p99):
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
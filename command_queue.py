@@ -0,0 +1,138 @@
+import asyncio
+import contextlib
+import re
+import time
+
+from llm_scheduler import COMBAT_PATTERN
+from telnet_protocol import ANSI_PATTERN
+from world_map import EXITS_PATTERN
+
+DEFAULT_MIN_INTERVAL = 0.2  # seconds between two commands of one burst
+DEFAULT_MAX_WAIT = 2.0  # give up waiting for the server's prompt after this long
+DEFAULT_STALE_CHARS = 2000  # this much unrelated output during one LLM call makes its answer stale
+
+EXITS_LINE_PATTERN = re.compile(EXITS_PATTERN.pattern, re.IGNORECASE | re.MULTILINE)
+
+
+def split_commands(command):
+    """'n|n|open door' -> ['n', 'n', 'open door']; an empty command is one empty line (Enter)."""
+    parts = [part.strip() for part in (command or '').split('|')]
+    parts = [part for part in parts if part]
+    return parts or ['']
+
+
+def went_stale(screen, output, stale_chars=DEFAULT_STALE_CHARS):
+    """
+    Why output that arrived while the LLM was deciding on `screen` makes its
+    answer stale, or None. Combat that started, a room that was shown (we were
+    moved) or a flood of text all mean the model decided on a different game
+    state than the one its command would now land in.
+    """
+    output = ANSI_PATTERN.sub('', output or '')
+    if not output.strip():
+        return None
+    if COMBAT_PATTERN.search(output) and not COMBAT_PATTERN.search(ANSI_PATTERN.sub('', screen or '')):
+        return "combat started"
+    if EXITS_LINE_PATTERN.search(output):
+        return "room changed"
+    if len(output) > stale_chars:
+        return f"{len(output)} chars of new output"
+    return None
+
+
+class CommandQueue:
+    """
+    Outbound commands for one connection. submit() splits pipe-separated
+    commands and a background task sends them one at a time: after each one it
+    waits for the server's next prompt (at most `max_wait`) and at least
+    `min_interval`, so a burst is not cut short by the server's input
+    throttle. cancel() drops what has not been sent yet. settled() tells the
+    game loop whether the last command's output has been read, so screens in
+    the middle of a burst are merged into the next turn instead of each
+    starting one; it stops waiting for that output after `max_wait`. With a
+    `metrics` object (see metrics.py) each send is timed as the 'send' phase.
+    """
+
+    def __init__(self, conn, min_interval=DEFAULT_MIN_INTERVAL, max_wait=DEFAULT_MAX_WAIT, split_pipes=True,
+                 metrics=None, session=None):
+        self.conn = conn
+        self.min_interval = min_interval
+        self.max_wait = max_wait
+        self.split_pipes = split_pipes
+        self.metrics = metrics
+        self.session = session
+        self._queue = asyncio.Queue()
+        self._task = None
+        self._sending = False
+        self._sent_at_prompt = -1  # conn.prompt_count when the latest command went out
+        self._sent_at = 0.0  # time.monotonic() of the latest send
+        self.stats = {"submitted": 0, "sent": 0, "cancelled": 0, "prompt_timeouts": 0}
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    def submit(self, command):
+        """Queue a command (or a pipe-separated burst). Call from the event loop thread."""
+        parts = split_commands(command) if self.split_pipes else [command or '']
+        for part in parts:
+            self._queue.put_nowait(part)
+        self.stats["submitted"] += len(parts)
+
+    def cancel(self):
+        """Drop every command not sent yet; returns how many were dropped."""
+        dropped = 0
+        while not self._queue.empty():
+            self._queue.get_nowait()
+            self._queue.task_done()
+            dropped += 1
+        self.stats["cancelled"] += dropped
+        return dropped
+
+    def settled(self):
+        """
+        True once nothing is queued or sending and the reply to the latest
+        command has been read, or `max_wait` has passed since it was sent (its
+        reply may end without a prompt we can detect).
+        """
+        if self._sending or not self._queue.empty():
+            return False
+        if self.conn.read_prompt_count > self._sent_at_prompt:
+            return True
+        return time.monotonic() - self._sent_at >= self.max_wait
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            command = await self._queue.get()
+            self._sending = True
+            try:
+                prompt_count = self.conn.prompt_count
+                started = loop.time()
+                self._sent_at_prompt = prompt_count
+                self._sent_at = time.monotonic()
+                with self.metrics.span('send', session=self.session) if self.metrics else contextlib.nullcontext():
+                    await self.conn.send(command)
+                self.stats["sent"] += 1
+                if not self._queue.empty():
+                    # More of the burst to come: let the server answer this one first
+                    if not await self.conn.wait_for_prompt(prompt_count, self.max_wait):
+                        self.stats["prompt_timeouts"] += 1
+                    pause = self.min_interval - (loop.time() - started)
+                    if pause > 0:
+                        await asyncio.sleep(pause)
+            except ConnectionError as e:
+                print(f"[WARN] Could not send '{command}': {e}")
+                self.cancel()
+            finally:
+                self._sending = False
+                self._queue.task_done()
+
+    async def close(self):
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except (asyncio.CancelledError, Exception):
+                pass
+            self._task = None
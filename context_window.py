@@ -0,0 +1,231 @@
+import hashlib
+import json
+
+CHARS_PER_TOKEN = 4  # rough average for English text with the llama/qwen tokenizers
+MESSAGE_OVERHEAD_TOKENS = 4  # role markers and separators added by the chat template
+SUMMARY_HEADER = "Summary of earlier turns:\n"
+
+
+def estimate_tokens(text):
+    if not text:
+        return 0
+    return (len(text) + CHARS_PER_TOKEN - 1) // CHARS_PER_TOKEN
+
+
+def estimate_message_tokens(message):
+    return estimate_tokens(message.get("content", "")) + MESSAGE_OVERHEAD_TOKENS
+
+
+def split_turns(messages):
+    """Group messages into turns, each starting at a user message."""
+    turns = []
+    for message in messages:
+        if message.get("role") == "user" or not turns:
+            turns.append([message])
+        else:
+            turns[-1].append(message)
+    return turns
+
+
+def extractive_summary(turns):
+    """
+    Summarize turns without calling a model: keep the journal/decision and the
+    command from each assistant reply, one line per turn.
+    """
+    lines = []
+    for turn in turns:
+        for message in turn:
+            if message.get("role") != "assistant":
+                continue
+            content = message.get("content", "")
+            try:
+                parsed = json.loads(content)
+            except (json.JSONDecodeError, TypeError):
+                parsed = None
+            if isinstance(parsed, dict):
+                note = parsed.get("journal") or parsed.get("decision") or ""
+                command = parsed.get("game_input", "")
+            else:
+                note = content
+                command = ""
+            note = " ".join(str(note).split())[:200]
+            line = f"- {note}" if note else "- (no notes)"
+            if command:
+                line += f" [sent: {command}]"
+            lines.append(line)
+    return "\n".join(lines)
+
+
+class ContextWindow:
+    """
+    Fit chat history into a token budget. The system prompt and the last
+    `keep_turns` turns are sent verbatim; older turns are folded into summaries
+    of `block_turns` turns each. Blocks are aligned to the start of the history,
+    so a block's summary never changes once written and is computed only once.
+
+    Over budget, whole blocks are folded early and the oldest summaries are
+    dropped for good, so the messages after the system prompt only change when
+    a block folds and the server's prompt-prefix cache keeps matching between.
+
+    The history is expected to grow by appending (only the system prompt at
+    index 0 is rewritten); new messages are grouped into turns and counted once,
+    so building the context costs the same on the thousandth turn as on the first.
+
+    With a `summary_store` (see history_loader.SummaryStore) summaries are also
+    persisted, and `prior_summaries` covering turns that were never loaded are
+    sent ahead of the in-memory ones. resume() lines the blocks of a reloaded
+    history up with the stored summaries, so a restart does not summarize the
+    same turns again under different block boundaries.
+    """
+
+    def __init__(self, token_budget=8000, keep_turns=6, block_turns=10, summarize_fn=None,
+                 summary_store=None):
+        self.token_budget = token_budget
+        self.keep_turns = keep_turns
+        self.block_turns = block_turns
+        self.summarize_fn = summarize_fn or extractive_summary
+        self.summary_store = summary_store
+        self.prior_summaries = []
+        self.last_stats = None
+        self._reset()
+
+    def _reset(self):
+        self._turns = []  # [first message, end message, tokens] per turn, indexes past the system prompt
+        self._scanned = 0  # Messages past the system prompt already grouped into turns
+        self._history_tokens = 0
+        self._folded = []  # (summary message, tokens, turns covered) per folded block, oldest first
+        self._folded_end = 0  # Turns folded into self._folded
+        self._dropped = 0  # Oldest summaries (prior ones first) no longer sent
+        self._prior = None  # (source list, [(summary message, tokens)]) for prior_summaries
+
+    def _block_key(self, block):
+        digest = hashlib.sha1()
+        for turn in block:
+            for message in turn:
+                digest.update(message.get("role", "").encode("utf-8"))
+                digest.update(b"\0")
+                digest.update(message.get("content", "").encode("utf-8"))
+                digest.update(b"\0")
+        return digest.hexdigest()
+
+    def _summarize_block(self, block):
+        key = self._block_key(block)
+        summary = None
+        if self.summary_store is not None:
+            summary = self.summary_store.get(key)
+        if summary is None:
+            summary = self.summarize_fn(block)
+            if self.summary_store is not None:
+                self.summary_store.put(key, summary, last_turn=self._block_key(block[-1:]))
+        return summary
+
+    def resume(self, chat_history, last_turn):
+        """
+        Start folding right after the turn whose key is `last_turn`, the last
+        turn covered by the newest stored summary. That turn and the ones before
+        it are left to the stored summaries. Returns False if it is not loaded.
+        """
+        offset = 1 if chat_history and chat_history[0].get("role") == "system" else 0
+        self._reset()
+        self._scan(chat_history, offset)
+        for i in range(len(self._turns) - 1, -1, -1):
+            if self._block_key(self._turn_messages(chat_history, offset, i, i + 1)) == last_turn:
+                self._folded_end = i + 1
+                return True
+        self._reset()
+        return False
+
+    def _scan(self, chat_history, offset):
+        """Group messages appended since the last call into turns and count their tokens."""
+        if len(chat_history) - offset < self._scanned:
+            self._reset()  # A different or truncated history
+        for i in range(offset + self._scanned, len(chat_history)):
+            message = chat_history[i]
+            tokens = estimate_message_tokens(message)
+            if message.get("role") == "user" or not self._turns:
+                self._turns.append([i - offset, i - offset + 1, tokens])
+            else:
+                self._turns[-1][1] += 1
+                self._turns[-1][2] += tokens
+            self._history_tokens += tokens
+        self._scanned = len(chat_history) - offset
+
+    def _turn_messages(self, chat_history, offset, first, end):
+        """The messages of turns [first, end), grouped by turn."""
+        return [chat_history[offset + start:offset + stop] for start, stop, _ in self._turns[first:end]]
+
+    def _fold(self, chat_history, offset, end):
+        """Summarize whole blocks until every turn before `end` is folded."""
+        while self._folded_end + self.block_turns <= end:
+            block_end = self._folded_end + self.block_turns
+            block = self._turn_messages(chat_history, offset, self._folded_end, block_end)
+            message = {"role": "system", "content": SUMMARY_HEADER + self._summarize_block(block)}
+            self._folded.append((message, estimate_message_tokens(message), self.block_turns))
+            self._folded_end = block_end
+
+    def _prior_messages(self):
+        if self._prior is None or self._prior[0] is not self.prior_summaries:
+            messages = [{"role": "system", "content": SUMMARY_HEADER + text} for text in self.prior_summaries]
+            self._prior = (self.prior_summaries, [(m, estimate_message_tokens(m)) for m in messages])
+            self._dropped = 0
+        return self._prior[1]
+
+    def build(self, chat_history):
+        """Return the list of messages to send for this turn and record stats in last_stats."""
+        system = []
+        offset = 0
+        if chat_history and chat_history[0].get("role") == "system":
+            system = [chat_history[0]]
+            offset = 1
+        self._scan(chat_history, offset)
+        system_tokens = sum(estimate_message_tokens(m) for m in system)
+
+        recent_start = max(0, len(self._turns) - self.keep_turns)
+        self._fold(chat_history, offset, recent_start)
+
+        def totals():
+            # (message, tokens, in-memory turns covered) of the summaries still sent, and the tokens in all
+            summaries = ([(m, tokens, 0) for m, tokens in self._prior_messages()] + self._folded)[self._dropped:]
+            verbatim = self._turns[self._folded_end:]
+            total = (system_tokens + sum(tokens for _, tokens, _ in summaries)
+                     + sum(tokens for _, _, tokens in verbatim))
+            return summaries, verbatim, total
+
+        # Over budget: fold the next block early, always keeping the latest turn
+        # verbatim, then stop sending the oldest summaries if they are what does
+        # not fit. Both stick, so the prefix stays the same until the verbatim
+        # turns outgrow the budget again.
+        summaries, verbatim, total = totals()
+        while total > self.token_budget and self._folded_end + self.block_turns < len(self._turns):
+            self._fold(chat_history, offset, self._folded_end + self.block_turns)
+            summaries, verbatim, total = totals()
+        verbatim_tokens = sum(tokens for _, _, tokens in verbatim)
+        while summaries and total > self.token_budget and system_tokens + verbatim_tokens <= self.token_budget:
+            total -= summaries.pop(0)[1]
+            self._dropped += 1
+
+        # Turns too large for the budget even after folding: for this request
+        # only, drop the oldest verbatim turns, then the summaries
+        first_turn = 0
+        while first_turn < len(verbatim) - 1 and total > self.token_budget:
+            total -= verbatim[first_turn][2]
+            first_turn += 1
+        first_summary = 0
+        while first_summary < len(summaries) and total > self.token_budget:
+            total -= summaries[first_summary][1]
+            first_summary += 1
+
+        sent_summaries = summaries[first_summary:]
+        verbatim = verbatim[first_turn:]
+        messages = (system + [m for m, _, _ in sent_summaries]
+                    + (chat_history[offset + verbatim[0][0]:] if verbatim else []))
+        full_tokens = system_tokens + self._history_tokens
+        self.last_stats = {
+            "tokens_sent": total,
+            "tokens_full": full_tokens,
+            "tokens_saved": max(0, full_tokens - total),
+            "summarized_turns": sum(turns for _, _, turns in sent_summaries),
+            "summaries": len(sent_summaries),
+            "verbatim_messages": len(messages) - len(system) - len(sent_summaries),
+        }
+        return messages
@@ -0,0 +1,145 @@
+import queue
+import threading
+import time
+
+from pymongo import ASCENDING, DESCENDING
+from pymongo.errors import PyMongoError
+
+HISTORY_PROJECTION = {"_id": 0, "timestamp": 1, "message": 1}
+
+
+class HistoryPager:
+    """
+    Load a session's chat history newest-first in pages instead of all at once.
+    load_tail() returns the most recent messages; older_page() walks further
+    back from the oldest message loaded so far. System prompts are skipped, the
+    client inserts the current one itself.
+    """
+
+    def __init__(self, coll, session_id, page_size=200):
+        self.coll = coll
+        self.session_id = session_id
+        self.page_size = page_size
+        self.oldest_timestamp = None
+        self.exhausted = False
+
+    def _fetch(self, limit, before=None):
+        query = {"session_id": self.session_id, "message.role": {"$ne": "system"}}
+        if before is not None:
+            query["timestamp"] = {"$lt": before}
+        cursor = self.coll.find(query, HISTORY_PROJECTION).sort("timestamp", DESCENDING).limit(limit)
+        docs = list(cursor)
+        if len(docs) < limit:
+            self.exhausted = True
+        if docs:
+            self.oldest_timestamp = docs[-1]["timestamp"]
+        docs.reverse()
+        return [d["message"] for d in docs]
+
+    def load_tail(self, limit=None):
+        self.oldest_timestamp = None
+        self.exhausted = False
+        return self._fetch(limit or self.page_size)
+
+    def older_page(self):
+        """Return the page just before what has been loaded, oldest first, or [] when there is none."""
+        if self.exhausted or self.oldest_timestamp is None:
+            return []
+        return self._fetch(self.page_size, before=self.oldest_timestamp)
+
+
+class SummaryStore:
+    """
+    Persist ContextWindow block summaries so they survive restarts and can stand
+    in for turns that were never loaded. get() and put() run on the LLM turn, so
+    neither waits on Mongo: get() answers from the summaries this process has
+    written and put() hands the write to a background thread. close() waits for
+    the writes still queued.
+    """
+
+    def __init__(self, coll, session_id):
+        self.coll = coll
+        self.session_id = session_id
+        self._indexed = False
+        self._cache = {}
+        self._queue = queue.Queue()
+        self._thread = None
+
+    def _ensure_index(self):
+        if self._indexed:
+            return
+        self._indexed = True
+        try:
+            self.coll.create_index([("session_id", ASCENDING), ("key", ASCENDING)], unique=True)
+            self.coll.create_index([("session_id", ASCENDING), ("created_at", ASCENDING)])
+        except PyMongoError as e:
+            print(f"[WARN] Could not create summary indexes: {e}")
+
+    def get(self, key):
+        return self._cache.get(key)
+
+    def put(self, key, summary, last_turn=None):
+        """Store a block's summary; `last_turn` is the key of the block's last turn (see ContextWindow.resume)."""
+        self._cache[key] = summary
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="summary-writer", daemon=True)
+            self._thread.start()
+        self._queue.put((key, summary, last_turn, time.time()))
+
+    def _run(self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                return
+            self._write(*item)
+
+    def _write(self, key, summary, last_turn, created_at):
+        self._ensure_index()
+        try:
+            self.coll.update_one(
+                {"session_id": self.session_id, "key": key},
+                {"$setOnInsert": {"summary": summary, "last_turn": last_turn, "created_at": created_at}},
+                upsert=True,
+            )
+        except PyMongoError as e:
+            print(f"[WARN] Could not store summary: {e}")
+
+    def close(self):
+        if self._thread is not None:
+            self._queue.put(None)
+            self._thread.join()
+            self._thread = None
+
+    def latest(self):
+        """The newest stored summary as {"summary", "last_turn", "created_at"}, or None."""
+        try:
+            docs = list(
+                self.coll.find({"session_id": self.session_id}, {"_id": 0, "summary": 1, "last_turn": 1, "created_at": 1})
+                .sort("created_at", DESCENDING)
+                .limit(1)
+            )
+        except PyMongoError as e:
+            print(f"[WARN] Could not load stored summaries: {e}")
+            return None
+        return docs[0] if docs else None
+
+    def before(self, timestamp, limit=20, inclusive=False):
+        """
+        Summaries written before `timestamp` (or at it, if `inclusive`), oldest
+        first. A summary is written after the turns it covers, so these never
+        overlap messages after it.
+        """
+        query = {"session_id": self.session_id}
+        if timestamp is not None:
+            query["created_at"] = {"$lte" if inclusive else "$lt": timestamp}
+        try:
+            docs = list(
+                self.coll.find(query, {"_id": 0, "summary": 1})
+                .sort("created_at", DESCENDING)
+                .limit(limit)
+            )
+        except PyMongoError as e:
+            print(f"[WARN] Could not load stored summaries: {e}")
+            return []
+        docs.reverse()
+        return [d["summary"] for d in docs]
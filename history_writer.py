@@ -0,0 +1,160 @@
+import json
+import os
+import queue
+import shutil
+import threading
+import time
+
+from pymongo import ASCENDING
+from pymongo.errors import BulkWriteError, PyMongoError
+
+
+class WriteBehindWriter:
+    """
+    Queue chat history documents and insert them from a background thread with
+    insert_many, flushing when `batch_size` documents are waiting or
+    `flush_interval` seconds have passed. If Mongo is unreachable, batches are
+    appended to `spill_path` as JSON lines and replayed once writes succeed again.
+    """
+
+    def __init__(self, coll, batch_size=50, flush_interval=1.0, spill_path='mongo_spill.jsonl'):
+        self.coll = coll
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.spill_path = spill_path
+        self._queue = queue.Queue()
+        self._thread = None
+        self._stop = threading.Event()
+        self._lock = threading.Lock()
+        self._started = False
+
+    def start(self):
+        if self._started:
+            return
+        self._started = True
+        try:
+            # load_chat_history_from_db() filters on session_id and sorts on timestamp
+            self.coll.create_index([("session_id", ASCENDING), ("timestamp", ASCENDING)])
+        except PyMongoError as e:
+            print(f"[WARN] Could not create history index: {e}")
+        self._replay_spill()
+        self._thread = threading.Thread(target=self._run, name="history-writer", daemon=True)
+        self._thread.start()
+
+    def enqueue(self, doc):
+        if not self._started:
+            self.start()
+        self._queue.put(doc)
+
+    def _drain(self, first=None, wait=False):
+        batch = [] if first is None else [first]
+        deadline = time.monotonic() + self.flush_interval
+        while len(batch) < self.batch_size:
+            timeout = deadline - time.monotonic()
+            if not wait or timeout <= 0:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            else:
+                try:
+                    batch.append(self._queue.get(timeout=timeout))
+                except queue.Empty:
+                    break
+        return batch
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                first = self._queue.get(timeout=0.5)
+            except queue.Empty:
+                continue
+            self._write(self._drain(first, wait=True))
+
+    def _write(self, batch):
+        if not batch:
+            return
+        with self._lock:
+            if os.path.exists(self.spill_path):
+                self._replay_spill(locked=True)
+                if os.path.exists(self.spill_path):
+                    # Still failing; keep order by spilling behind the older batches
+                    self._spill(batch)
+                    return
+            self._insert_or_spill(batch)
+
+    def _insert_or_spill(self, batch):
+        # insert_many adds _id to the documents it is given, so hand it copies
+        try:
+            self.coll.insert_many([dict(doc) for doc in batch], ordered=True)
+            return True
+        except BulkWriteError as e:
+            inserted = e.details.get('nInserted', 0)
+            print(f"[WARN] History batch partially written ({inserted}/{len(batch)}); spilling the rest")
+            self._spill(batch[inserted:])
+        except PyMongoError as e:
+            print(f"[WARN] History write failed, spilling {len(batch)} messages to {self.spill_path}: {e}")
+            self._spill(batch)
+        return False
+
+    def _spill(self, batch):
+        with open(self.spill_path, "a", encoding="utf-8") as f:
+            for doc in batch:
+                f.write(json.dumps(doc, ensure_ascii=False) + "\n")
+
+    def _read_spill(self, path):
+        docs = []
+        with open(path, "r", encoding="utf-8") as f:
+            for line in f:
+                if not line.strip():
+                    continue
+                try:
+                    docs.append(json.loads(line))
+                except json.JSONDecodeError:
+                    continue  # A torn last line from a crash in _spill
+        return docs
+
+    def _replay_spill(self, locked=False):
+        replay_path = self.spill_path + ".replay"
+        if not os.path.exists(self.spill_path) and not os.path.exists(replay_path):
+            return
+        if not locked:
+            with self._lock:
+                return self._replay_spill(locked=True)
+        if os.path.exists(self.spill_path):
+            if os.path.exists(replay_path):
+                # A crash mid-replay left older messages behind; replay them first
+                with open(replay_path, "rb+") as dst, open(self.spill_path, "rb") as src:
+                    dst.seek(0, os.SEEK_END)
+                    if dst.tell():
+                        dst.seek(-1, os.SEEK_END)
+                        if dst.read(1) != b"\n":
+                            dst.write(b"\n")
+                    shutil.copyfileobj(src, dst)
+                os.remove(self.spill_path)
+            else:
+                os.replace(self.spill_path, replay_path)
+        docs = self._read_spill(replay_path)
+        for start in range(0, len(docs), self.batch_size):
+            if not self._insert_or_spill(docs[start:start + self.batch_size]):
+                # Keep whatever was not attempted behind the part that just spilled
+                self._spill(docs[start + self.batch_size:])
+                break
+        else:
+            print(f"[INFO] Replayed {len(docs)} spilled history messages")
+        os.remove(replay_path)
+
+    def flush(self):
+        """Write everything queued so far, on the calling thread."""
+        while True:
+            batch = self._drain()
+            if not batch:
+                break
+            self._write(batch)
+
+    def close(self):
+        self._stop.set()
+        if self._thread:
+            # No timeout: a batch still being inserted would be lost with the daemon thread
+            self._thread.join()
+        self.flush()
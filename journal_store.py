@@ -0,0 +1,128 @@
+import collections
+import json
+import os
+import threading
+import time
+
+from session_log import COMPRESS_GZIP, compress_file
+
+TAIL_BLOCK_SIZE = 8192
+
+
+def read_tail_lines(path, n, block_size=TAIL_BLOCK_SIZE):
+    """Return the last n non-empty lines of a file by seeking backwards from the end."""
+    if n <= 0 or not os.path.exists(path):
+        return []
+    with open(path, "rb") as f:
+        f.seek(0, os.SEEK_END)
+        pos = f.tell()
+        data = b""
+        while pos > 0 and data.count(b"\n") <= n:
+            step = min(block_size, pos)
+            pos -= step
+            f.seek(pos)
+            data = f.read(step) + data
+    lines = [line for line in data.split(b"\n") if line.strip()]
+    if pos > 0:
+        # The first line may have been cut by the block boundary
+        lines = lines[1:]
+    return [line.decode("utf-8", errors="ignore") for line in lines[-n:]]
+
+
+class JournalStore:
+    """
+    Append-only JSONL journal with the most recent `capacity` entries kept in
+    memory, so reading recent memories never touches the disk. On cold start the
+    ring buffer is filled from the end of the file. When the file grows past
+    `max_bytes` it is renamed to a timestamped segment, gzipped by a background
+    thread, and a new file started. With `index=True` byte offsets of every
+    line are kept for random access.
+    """
+
+    def __init__(self, path, capacity=50, max_bytes=0, index=False):
+        self.path = path
+        self.capacity = capacity
+        self.max_bytes = max_bytes
+        self._recent = collections.deque(maxlen=capacity)
+        self._offsets = [] if index else None
+        self._size = 0
+        self._lock = threading.Lock()
+        self._loaded = False
+
+    def _load(self):
+        if self._loaded:
+            return
+        self._loaded = True
+        for line in read_tail_lines(self.path, self.capacity):
+            try:
+                self._recent.append(json.loads(line))
+            except json.JSONDecodeError:
+                continue
+        if os.path.exists(self.path):
+            self._size = os.path.getsize(self.path)
+            if self._offsets is not None:
+                self._build_index()
+
+    def _build_index(self):
+        self._offsets = []
+        offset = 0
+        with open(self.path, "rb") as f:
+            for line in f:
+                if line.strip():
+                    self._offsets.append(offset)
+                offset += len(line)
+
+    def append(self, entry):
+        line = (json.dumps(entry, ensure_ascii=False) + "\n").encode("utf-8")
+        with self._lock:
+            self._load()
+            with open(self.path, "ab") as f:
+                f.write(line)
+            if self._offsets is not None:
+                self._offsets.append(self._size)
+            self._size += len(line)
+            self._recent.append(entry)
+            if self.max_bytes and self._size > self.max_bytes:
+                self._rotate()
+
+    def _segment_path(self):
+        stamp = time.strftime("%Y%m%d-%H%M%S")
+        root, ext = os.path.splitext(self.path)
+        seq = 0
+        while True:
+            # The counter keeps two rotations within one second apart
+            segment = f"{root}.{stamp}-{seq:02d}{ext}"
+            if not os.path.exists(segment) and not os.path.exists(segment + ".gz"):
+                return segment
+            seq += 1
+
+    def _rotate(self):
+        # Only the rename happens under the lock; compressing a large journal
+        # would otherwise stall the turn that crossed max_bytes
+        segment = self._segment_path()
+        os.replace(self.path, segment)
+        self._size = 0
+        if self._offsets is not None:
+            self._offsets = []
+        # Not a daemon, so the interpreter waits for it at exit
+        threading.Thread(target=compress_file, args=(segment, segment + ".gz", COMPRESS_GZIP),
+                         name="journal-compress").start()
+        print(f"[INFO] Rotated journal to {segment}.gz")
+
+    def recent(self, n):
+        """Return up to n most recent entries, oldest first."""
+        with self._lock:
+            self._load()
+            if n <= 0:
+                return []
+            return list(self._recent)[-n:]
+
+    def get(self, i):
+        """Read entry i of the current file by seeking to its offset; requires index=True."""
+        with self._lock:
+            self._load()
+            if self._offsets is None:
+                raise ValueError("JournalStore was created without index=True")
+            with open(self.path, "rb") as f:
+                f.seek(self._offsets[i])
+                return json.loads(f.readline())
@@ -0,0 +1,71 @@
+import asyncio
+import heapq
+import itertools
+import re
+
+# Lower runs first. A character's configured priority is added on top.
+PRIORITY_COMBAT = 0
+PRIORITY_IDLE = 10
+
+COMBAT_PATTERN = re.compile(
+    r"(?:You (?:are fighting|flee|parry|dodge)|"
+    r"\b(?:hits?|misses|mauls?|wounds?|scratches|massacres?|decimates?) you\b|"
+    r"\bYour \w+ (?:hits?|misses|wounds?|mauls?|scratches|massacres?|decimates?)\b|"
+    r"\bis DEAD\b|\bparries your\b|\bdodges your\b)",
+    re.IGNORECASE,
+)
+
+
+def turn_priority(screen_text, base=0):
+    """Combat screens jump the queue ahead of idle ones."""
+    if COMBAT_PATTERN.search(screen_text or ''):
+        return base + PRIORITY_COMBAT
+    return base + PRIORITY_IDLE
+
+
+class LLMScheduler:
+    """
+    Share a limited number of LLM slots between characters on one event loop.
+    Requests beyond `max_concurrent` wait in a priority queue; ties are served in
+    arrival order. The blocking request function runs in a worker thread.
+    """
+
+    def __init__(self, max_concurrent=1):
+        self.max_concurrent = max_concurrent
+        self._active = 0
+        self._waiting = []
+        self._seq = itertools.count()
+        self.stats = {"requests": 0, "queued": 0, "max_queue": 0}
+
+    async def _acquire(self, priority):
+        if self._active < self.max_concurrent and not self._waiting:
+            self._active += 1
+            return
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._waiting, (priority, next(self._seq), future))
+        self.stats["queued"] += 1
+        self.stats["max_queue"] = max(self.stats["max_queue"], len(self._waiting))
+        try:
+            await future
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():
+                # The slot was handed to us just as we were cancelled
+                self._release()
+            raise
+
+    def _release(self):
+        while self._waiting:
+            _, _, future = heapq.heappop(self._waiting)
+            if not future.done():
+                # Hand the slot straight to the next waiter
+                future.set_result(None)
+                return
+        self._active -= 1
+
+    async def run(self, priority, fn, *args):
+        await self._acquire(priority)
+        self.stats["requests"] += 1
+        try:
+            return await asyncio.to_thread(fn, *args)
+        finally:
+            self._release()
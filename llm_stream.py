@@ -0,0 +1,163 @@
+import json
+import re
+
+import requests
+
+# Parser states
+SEEK_KEY = 0
+IN_KEY = 1
+SEEK_COLON = 2
+SEEK_VALUE = 3
+IN_STRING = 4
+IN_OTHER = 5
+
+
+def _decode_string(raw, quote):
+    # Escaped single quotes are not valid JSON; clean_llm_json() drops the backslash too.
+    raw = raw.replace("\\'", "'")
+    if quote == "'":
+        raw = re.sub(r'(?<!\\)"', '\\"', raw)
+    try:
+        return json.loads('"' + raw + '"', strict=False)
+    except json.JSONDecodeError:
+        return raw
+
+
+def _decode_other(raw):
+    raw = raw.strip()
+    try:
+        return json.loads(raw)
+    except json.JSONDecodeError:
+        return raw
+
+
+class IncrementalJSONParser:
+    """
+    Parse the top-level fields of a JSON object as it streams in, reporting each
+    field as soon as its value is complete. Tolerates the same junk that
+    clean_llm_json() repairs: code fences, outer quotes, doubled braces and
+    single-quoted strings. Anything before the first '{' is ignored.
+    """
+
+    def __init__(self):
+        self.fields = {}
+        self._state = SEEK_KEY
+        self._opened = False
+        self._quote = None
+        self._escape = False
+        self._key = ""
+        self._raw = []
+        self._depth = 0
+        self._other_quote = None
+
+    def feed(self, text):
+        """Consume a chunk and return a list of (key, value) pairs completed by it."""
+        completed = []
+        for ch in text:
+            state = self._state
+            if state == SEEK_KEY:
+                if ch == '{':
+                    self._opened = True
+                elif self._opened and ch in ('"', "'"):
+                    self._quote = ch
+                    self._raw = []
+                    self._state = IN_KEY
+            elif state == IN_KEY or state == IN_STRING:
+                if self._escape:
+                    self._raw.append(ch)
+                    self._escape = False
+                elif ch == '\\':
+                    self._raw.append(ch)
+                    self._escape = True
+                elif ch == self._quote:
+                    value = _decode_string(''.join(self._raw), self._quote)
+                    if state == IN_KEY:
+                        self._key = value
+                        self._state = SEEK_COLON
+                    else:
+                        completed.append(self._complete(value))
+                else:
+                    self._raw.append(ch)
+            elif state == SEEK_COLON:
+                if ch == ':':
+                    self._state = SEEK_VALUE
+                elif not ch.isspace():
+                    # A bare string in key position; start over at this character.
+                    self._state = SEEK_KEY
+            elif state == SEEK_VALUE:
+                if ch in ('"', "'"):
+                    self._quote = ch
+                    self._raw = []
+                    self._state = IN_STRING
+                elif not ch.isspace():
+                    self._raw = [ch]
+                    self._depth = 1 if ch in '{[' else 0
+                    self._other_quote = None
+                    self._state = IN_OTHER
+            elif state == IN_OTHER:
+                if self._other_quote:
+                    self._raw.append(ch)
+                    if self._escape:
+                        self._escape = False
+                    elif ch == '\\':
+                        self._escape = True
+                    elif ch == self._other_quote:
+                        self._other_quote = None
+                elif ch in ('"', "'"):
+                    self._raw.append(ch)
+                    self._other_quote = ch
+                elif ch in '{[':
+                    self._raw.append(ch)
+                    self._depth += 1
+                elif ch in '}]' and self._depth > 0:
+                    self._raw.append(ch)
+                    self._depth -= 1
+                    if self._depth == 0:
+                        completed.append(self._complete(_decode_other(''.join(self._raw))))
+                elif self._depth == 0 and (ch == ',' or ch == '}'):
+                    completed.append(self._complete(_decode_other(''.join(self._raw))))
+                else:
+                    self._raw.append(ch)
+        return completed
+
+    def _complete(self, value):
+        self.fields[self._key] = value
+        self._state = SEEK_KEY
+        self._raw = []
+        return self._key, value
+
+
+def stream_chat(url, payload, headers=None, on_field=None, session=None, timeout=None):
+    """
+    POST a chat request with "stream": true and feed the message content to an
+    IncrementalJSONParser as it arrives. on_field(key, value) is called for
+    each completed top-level field. Returns (content, thinking, parser, final),
+    where final is the last NDJSON chunk (it holds eval counts and timings).
+    """
+    http = session or requests
+    payload = {**payload, "stream": True}
+    parser = IncrementalJSONParser()
+    content_parts = []
+    thinking_parts = []
+    final = {}
+    with http.post(url, headers=headers, data=json.dumps(payload), stream=True, timeout=timeout) as response:
+        response.raise_for_status()
+        for line in response.iter_lines():
+            if not line:
+                continue
+            chunk = json.loads(line)
+            if chunk.get("error"):
+                raise ValueError(f"Ollama error: {chunk['error']}")
+            message = chunk.get("message", {})
+            if message.get("thinking"):
+                thinking_parts.append(message["thinking"])
+            text = message.get("content", "")
+            if text:
+                content_parts.append(text)
+                for key, value in parser.feed(text):
+                    if on_field:
+                        on_field(key, value)
+            if chunk.get("done"):
+                final = chunk
+                break
+    return ''.join(content_parts), ''.join(thinking_parts), parser, final
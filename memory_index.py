@@ -0,0 +1,224 @@
+import hashlib
+import json
+import os
+import re
+import threading
+
+import requests
+
+try:
+    import numpy as np
+except ImportError:  # Semantic memory is optional; the client falls back to recent entries only
+    np = None
+
+TOKEN_PATTERN = re.compile(r"[a-z0-9']+")
+
+
+def truncate_file(path, size):
+    if os.path.exists(path) and os.path.getsize(path) > size:
+        with open(path, 'r+b') as f:
+            f.truncate(size)
+
+
+class HashingEmbedder:
+    """
+    Offline embedder: words and word bigrams hashed into `dim` signed buckets
+    (the hashing trick), then L2-normalized. Good enough to find the journal
+    entry that mentions the same shop or NPC as the current screen.
+    """
+
+    def __init__(self, dim=512):
+        self.dim = dim
+        self.name = f"hashing-{dim}"
+
+    def _features(self, text):
+        words = TOKEN_PATTERN.findall(text.lower())
+        return words + [f"{a} {b}" for a, b in zip(words, words[1:])]
+
+    def embed(self, texts):
+        out = np.zeros((len(texts), self.dim), dtype=np.float32)
+        for row, text in enumerate(texts):
+            for feature in self._features(text):
+                digest = hashlib.blake2b(feature.encode('utf-8'), digest_size=8).digest()
+                value = int.from_bytes(digest, 'little')
+                out[row, value % self.dim] += 1.0 if (value >> 63) & 1 else -1.0
+        norms = np.linalg.norm(out, axis=1, keepdims=True)
+        norms[norms == 0] = 1.0
+        return out / norms
+
+
+class OllamaEmbedder:
+    """Embeddings from Ollama's /api/embed endpoint."""
+
+    def __init__(self, url, model, session=None):
+        self.url = url
+        self.model = model
+        self.name = f"ollama-{model}"
+        self.session = session or requests
+
+    def embed(self, texts):
+        response = self.session.post(self.url, data=json.dumps({"model": self.model, "input": texts}))
+        response.raise_for_status()
+        vectors = np.asarray(response.json()["embeddings"], dtype=np.float32)
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        norms[norms == 0] = 1.0
+        return vectors / norms
+
+
+class MemoryIndex:
+    """
+    Cosine-similarity index over journal entries. Vectors are appended to a raw
+    float32 file (`<prefix>.f32`) and read back memory-mapped; entry texts and
+    keys go to `<prefix>.jsonl`. add() appends one entry, so the index grows
+    incrementally with the journal. If the embedder changes, the index is rebuilt.
+    """
+
+    def __init__(self, prefix, embedder):
+        self.prefix = prefix
+        self.embedder = embedder
+        self.vectors_path = prefix + '.f32'
+        self.meta_path = prefix + '.jsonl'
+        self.header_path = prefix + '.json'
+        self._lock = threading.Lock()
+        self._texts = []
+        self._keys = set()
+        self._matrix = None  # Rows [0, len(self)) are live; spare rows let appends skip a copy
+        self._dim = None
+        self._load()
+
+    def _load(self):
+        header = {}
+        if os.path.exists(self.header_path):
+            with open(self.header_path, 'r', encoding='utf-8') as f:
+                header = json.load(f)
+        if header.get('embedder') != self.embedder.name:
+            # New or different embedder: start over
+            for path in (self.vectors_path, self.meta_path):
+                if os.path.exists(path):
+                    os.remove(path)
+            return
+        self._dim = header['dim']
+        metas = []
+        meta_ends = []  # Byte offset just past each meta line
+        offset = 0
+        if os.path.exists(self.meta_path):
+            with open(self.meta_path, 'rb') as f:
+                for line in f:
+                    if line.strip():
+                        try:
+                            meta = json.loads(line) if line.endswith(b'\n') else None
+                        except json.JSONDecodeError:
+                            meta = None
+                        if meta is None:
+                            break  # A torn last line from a crash
+                        metas.append(meta)
+                        meta_ends.append(offset + len(line))
+                    offset += len(line)
+        row_bytes = self._dim * np.dtype(np.float32).itemsize
+        vector_rows = os.path.getsize(self.vectors_path) // row_bytes if os.path.exists(self.vectors_path) else 0
+        rows = min(vector_rows, len(metas))
+        # A crash between the vector and meta writes leaves one file ahead of the
+        # other; cut both back to the rows they share so later appends line up
+        truncate_file(self.vectors_path, rows * row_bytes)
+        truncate_file(self.meta_path, meta_ends[rows - 1] if rows else 0)
+        metas = metas[:rows]
+        self._texts = [meta['text'] for meta in metas]
+        self._keys = {meta['key'] for meta in metas}
+        if rows:
+            vectors = np.memmap(self.vectors_path, dtype=np.float32, mode='r', shape=(rows, self._dim))
+            self._append_rows(vectors)
+            del vectors
+
+    def _append_rows(self, vectors):
+        count = len(self._texts) - len(vectors)
+        needed = count + len(vectors)
+        if self._matrix is None or needed > len(self._matrix):
+            capacity = max(needed, 2 * (len(self._matrix) if self._matrix is not None else 64))
+            matrix = np.zeros((capacity, vectors.shape[1]), dtype=np.float32)
+            if self._matrix is not None:
+                matrix[:count] = self._matrix[:count]
+            self._matrix = matrix
+        self._matrix[count:needed] = vectors
+
+    def __len__(self):
+        return len(self._texts)
+
+    def __contains__(self, key):
+        return key in self._keys
+
+    def add_many(self, items):
+        """Index (key, text) pairs whose key is not indexed yet."""
+        with self._lock:
+            items = [(k, t) for k, t in items if k not in self._keys and t]
+            if not items:
+                return 0
+            vectors = self.embedder.embed([t for _, t in items]).astype(np.float32)
+            if self._dim is None:
+                self._dim = vectors.shape[1]
+                with open(self.header_path, 'w', encoding='utf-8') as f:
+                    json.dump({"embedder": self.embedder.name, "dim": self._dim}, f)
+            with open(self.vectors_path, 'ab') as f:
+                f.write(vectors.tobytes())
+            with open(self.meta_path, 'a', encoding='utf-8') as f:
+                for key, text in items:
+                    f.write(json.dumps({"key": key, "text": text}, ensure_ascii=False) + "\n")
+            self._texts.extend(t for _, t in items)
+            self._keys.update(k for k, _ in items)
+            self._append_rows(vectors)
+            return len(items)
+
+    def add(self, key, text):
+        return self.add_many([(key, text)])
+
+    def search(self, query, k=3, exclude=()):
+        """Top-k entry texts by cosine similarity to `query`, skipping texts in `exclude`."""
+        with self._lock:
+            if self._matrix is None or not self._texts or k <= 0:
+                return []
+            q = self.embedder.embed([query])[0]
+            scores = self._matrix[:len(self._texts)] @ q
+            wanted = min(len(scores), k + len(exclude))
+            top = np.argpartition(-scores, wanted - 1)[:wanted]
+            top = top[np.argsort(-scores[top])]
+            results = []
+            for i in top:
+                text = self._texts[i]
+                if scores[i] <= 0 or text in exclude:
+                    continue
+                results.append(text)
+                if len(results) >= k:
+                    break
+            return results
+
+
+def journal_key(entry):
+    return f"journal:{entry.get('timestamp')}"
+
+
+def summary_key(entry):
+    return f"summary:{entry.get('log_file')}"
+
+
+def sync_sources(index, journal_path, summaries_path):
+    """Index journal lines and session summaries that are not indexed yet; returns how many were added."""
+    items = []
+    if os.path.exists(journal_path):
+        with open(journal_path, 'r', encoding='utf-8') as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except json.JSONDecodeError:
+                    continue
+                items.append((journal_key(entry), entry.get('journal', '')))
+    if os.path.exists(summaries_path):
+        try:
+            with open(summaries_path, 'r', encoding='utf-8') as f:
+                entries = json.load(f).get('entries', [])
+        except (OSError, json.JSONDecodeError):
+            entries = []
+        for entry in entries:
+            items.append((summary_key(entry), entry.get('journal_entry', '')))
+    added = 0
+    for start in range(0, len(items), 256):
+        added += index.add_many(items[start:start + 256])
+    return added
@@ -0,0 +1,162 @@
+import bisect
+import collections
+import contextlib
+import json
+import queue
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Upper bounds in seconds; covers a fast socket read up to a slow 32B reasoning turn
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+
+
+def _label_key(labels):
+    return tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+
+def _format_labels(key, extra=()):
+    pairs = list(key) + list(extra)
+    if not pairs:
+        return ''
+    body = ','.join('{}="{}"'.format(k, v.replace('\\', '\\\\').replace('"', '\\"')) for k, v in pairs)
+    return '{' + body + '}'
+
+
+class Metrics:
+    """
+    In-process counters and phase timings for the game loop. span() times a
+    block into the `<namespace>_phase_seconds` histogram, inc() bumps a
+    counter; both only take a lock and update a few numbers, so they stay on in
+    production. With a port the metrics are served in Prometheus text format on
+    http://host:port/metrics, and with a trace_path every span is also appended
+    to a JSONL file by a background thread.
+    """
+
+    def __init__(self, port=0, host='127.0.0.1', trace_path=None, namespace='mud', buckets=DEFAULT_BUCKETS):
+        self.port = port
+        self.host = host
+        self.trace_path = trace_path
+        self.namespace = namespace
+        self.buckets = buckets
+        self._lock = threading.Lock()
+        self._counters = collections.defaultdict(float)  # (name, labels) -> value
+        self._histograms = {}  # (name, labels) -> [bucket counts..., overflow count, sum, count]
+        self._trace_queue = queue.Queue() if trace_path else None
+        self._trace_thread = None
+        self._server = None
+
+    def start(self):
+        if self.port and self._server is None:
+            self._server = ThreadingHTTPServer((self.host, self.port), self._make_handler())
+            threading.Thread(target=self._server.serve_forever, name="metrics-http", daemon=True).start()
+            print(f"[INFO] Serving metrics on http://{self.host}:{self.port}/metrics")
+        if self._trace_queue is not None and self._trace_thread is None:
+            self._trace_thread = threading.Thread(target=self._write_trace, name="metrics-trace", daemon=True)
+            self._trace_thread.start()
+
+    def inc(self, name, value=1, **labels):
+        with self._lock:
+            self._counters[(name, _label_key(labels))] += value
+
+    def observe(self, name, seconds, **labels):
+        key = (name, _label_key(labels))
+        with self._lock:
+            hist = self._histograms.get(key)
+            if hist is None:
+                hist = self._histograms[key] = [0] * (len(self.buckets) + 3)
+            hist[bisect.bisect_left(self.buckets, seconds)] += 1
+            hist[-2] += seconds
+            hist[-1] += 1
+
+    @contextlib.contextmanager
+    def span(self, phase, **labels):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - started
+            self.observe('phase_seconds', elapsed, phase=phase, **labels)
+            if self._trace_queue is not None:
+                self._trace_queue.put({"time": time.time(), "span": phase, "seconds": round(elapsed, 6), **labels})
+
+    def counter(self, name, **labels):
+        with self._lock:
+            return self._counters.get((name, _label_key(labels)), 0)
+
+    def phase_totals(self):
+        """{phase: (count, total_seconds)} summed over all labels, for log summaries."""
+        totals = collections.defaultdict(lambda: [0, 0.0])
+        with self._lock:
+            for (name, key), hist in self._histograms.items():
+                if name == 'phase_seconds':
+                    phase = dict(key)['phase']
+                    totals[phase][0] += hist[-1]
+                    totals[phase][1] += hist[-2]
+        return {phase: tuple(v) for phase, v in totals.items()}
+
+    def render(self):
+        """All metrics in the Prometheus text exposition format."""
+        lines = []
+        with self._lock:
+            counters = sorted(self._counters.items())
+            histograms = sorted((k, list(v)) for k, v in self._histograms.items())
+        seen = set()
+        for (name, key), value in counters:
+            full = f"{self.namespace}_{name}"
+            if full not in seen:
+                seen.add(full)
+                lines.append(f"# TYPE {full} counter")
+            lines.append(f"{full}{_format_labels(key)} {value:g}")
+        for (name, key), hist in histograms:
+            full = f"{self.namespace}_{name}"
+            if full not in seen:
+                seen.add(full)
+                lines.append(f"# TYPE {full} histogram")
+            cumulative = 0
+            for bound, count in zip(self.buckets, hist):
+                cumulative += count
+                lines.append(f"{full}_bucket{_format_labels(key, [('le', f'{bound:g}')])} {cumulative}")
+            lines.append(f"{full}_bucket{_format_labels(key, [('le', '+Inf')])} {hist[-1]}")
+            lines.append(f"{full}_sum{_format_labels(key)} {hist[-2]:.6f}")
+            lines.append(f"{full}_count{_format_labels(key)} {hist[-1]}")
+        return '\n'.join(lines) + '\n'
+
+    def _write_trace(self):
+        with open(self.trace_path, 'a', encoding='utf-8') as out:
+            while True:
+                record = self._trace_queue.get()
+                if record is None:
+                    break
+                out.write(json.dumps(record, ensure_ascii=False) + "\n")
+                if self._trace_queue.empty():
+                    out.flush()
+
+    def _make_handler(self):
+        metrics = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split('?')[0] != '/metrics':
+                    self.send_error(404)
+                    return
+                body = metrics.render().encode('utf-8')
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+        return Handler
+
+    def close(self):
+        if self._trace_thread is not None:
+            self._trace_queue.put(None)
+            self._trace_thread.join(timeout=5)
+            self._trace_thread = None
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
@@ -0,0 +1,95 @@
+import collections
+
+from llm_scheduler import COMBAT_PATTERN
+from reflexes import ERROR_PATTERN
+from telnet_protocol import ANSI_PATTERN
+
+TIER_FAST = 'fast'
+TIER_DEEP = 'deep'
+
+
+class ModelRouter:
+    """
+    Pick a model tier per turn from cheap signals. Routine turns go to the fast
+    model; a turn goes to the deep (thinking) model when we are in combat, the
+    screen shows a room the map has never seen, the goal has not changed for
+    `goal_stale_turns` LLM turns, or the fast model's previous answer failed to
+    parse or drew an error from the game. route() returns (tier, reasons).
+    """
+
+    def __init__(self, fast_model, deep_model, goal_stale_turns=20):
+        self.models = {
+            TIER_FAST: {"model": fast_model, "think": False},
+            TIER_DEEP: {"model": deep_model, "think": True},
+        }
+        self.goal_stale_turns = goal_stale_turns
+        self.stats = {tier: collections.Counter() for tier in self.models}
+        self.reasons = collections.Counter()
+        self._new_room = False
+        self._last_goal = None
+        self._turns_on_goal = 0
+        self._last_tier = None
+        self._fast_failed = False
+
+    def observe_room(self, new_room):
+        """Called for every game screen; remembers whether a new room appeared since the last LLM turn."""
+        self._new_room = self._new_room or new_room
+
+    def route(self, screen, goal):
+        if goal != self._last_goal:
+            self._last_goal = goal
+            self._turns_on_goal = 0
+        self._turns_on_goal += 1
+
+        reasons = []
+        text = ANSI_PATTERN.sub('', screen or '')
+        if COMBAT_PATTERN.search(text):
+            reasons.append('combat')
+        if self._new_room:
+            reasons.append('new_room')
+        if self.goal_stale_turns and self._turns_on_goal > self.goal_stale_turns:
+            reasons.append('stale_goal')
+            self._turns_on_goal = 0  # Re-plan once, then give the fast model another stretch
+        if self._last_tier == TIER_FAST:
+            if self._fast_failed:
+                reasons.append('parse_failure')
+            elif ERROR_PATTERN.search(text):
+                reasons.append('game_error')
+
+        self._new_room = False
+        self._fast_failed = False
+        tier = TIER_DEEP if reasons else TIER_FAST
+        self._last_tier = tier
+        self.reasons.update(reasons or ['routine'])
+        return tier, reasons
+
+    def model_for(self, tier):
+        return self.models[tier]["model"], self.models[tier]["think"]
+
+    def record(self, tier, seconds, final_chunk=None):
+        stats = self.stats[tier]
+        stats["requests"] += 1
+        stats["ms"] += int(seconds * 1000)
+        if final_chunk:
+            stats["prompt_tokens"] += final_chunk.get('prompt_eval_count') or 0
+            stats["completion_tokens"] += final_chunk.get('eval_count') or 0
+
+    def parse_failed(self, tier):
+        self.stats[tier]["parse_failures"] += 1
+        if tier == TIER_FAST:
+            self._fast_failed = True
+
+    def summary(self):
+        parts = []
+        for tier, stats in self.stats.items():
+            requests = stats["requests"]
+            if not requests:
+                continue
+            parts.append(
+                f"{tier} ({self.models[tier]['model']}): {requests} turns, "
+                f"{stats['ms'] / requests:.0f}ms avg, "
+                f"{stats['prompt_tokens'] / requests:.0f}/{stats['completion_tokens'] / requests:.0f} tokens in/out, "
+                f"{stats['parse_failures']} parse failures"
+            )
+        reasons = ', '.join(f"{reason} {count}" for reason, count in self.reasons.most_common())
+        return '; '.join(parts) + (f" [{reasons}]" if reasons else '')
@@ -1,4 +1,5 @@
-import telnetlib
+import asyncio
+import collections
 import requests
 import time
 import json
@@ -6,6 +7,24 @@ import os
 import re
 from dotenv import load_dotenv
 from pymongo import MongoClient
+from mud_connection import MudConnection
+from model_router import ModelRouter
+from command_queue import CommandQueue, went_stale
+from context_window import ContextWindow
+from history_loader import HistoryPager, SummaryStore
+from history_writer import WriteBehindWriter
+from journal_store import JournalStore
+from llm_scheduler import COMBAT_PATTERN, turn_priority
+from metrics import Metrics
+from memory_index import HashingEmbedder, MemoryIndex, OllamaEmbedder, journal_key, np, sync_sources
+from llm_stream import IncrementalJSONParser, stream_chat
+from prompt_layout import LAYOUT_LEGACY, system_prompt_for, finalize_messages, request_options
+from reflexes import ReflexEngine, load_rules
+from screen_compressor import ScreenCompressor, merge_screens
+from session_log import SessionLog
+from state_publisher import StatePublisher
+from telnet_protocol import strip_control
+from world_map import TRAVEL_PATTERN, Travel, WorldMap
 
 # ------------------ ENV & MONGO SETUP ------------------
 load_dotenv()
@@ -13,45 +32,189 @@ load_dotenv()
 MONGO_URI = os.getenv('MONGO_URI', 'mongodb://localhost:27017')
 DB_NAME = os.getenv('MUD_DB_NAME', 'mud_llm')
 COLL_NAME = os.getenv('MUD_HISTORY_COLL', 'chat_history')
+SUMMARY_COLL_NAME = os.getenv('MUD_SUMMARY_COLL', 'history_summaries')
 
 client = MongoClient(MONGO_URI)
 db = client[DB_NAME]
 coll = db[COLL_NAME]
+summary_coll = db[SUMMARY_COLL_NAME]
+history_writer = WriteBehindWriter(
+    coll,
+    batch_size=int(os.getenv('MONGO_BATCH_SIZE', '50')),
+    flush_interval=float(os.getenv('MONGO_FLUSH_INTERVAL', '1.0')),
+    spill_path=os.getenv('MONGO_SPILL_PATH', 'mongo_spill.jsonl'),
+)
 
 USERNAME = os.getenv('MUD_USERNAME')
 PASSWORD = os.getenv('MUD_PASSWORD')
 MUD_HOST = os.getenv('MUD_HOST')
-MUD_PORT = int(os.getenv('MUD_PORT'))
+MUD_PORT = int(os.getenv('MUD_PORT')) if os.getenv('MUD_PORT') else None  # Required unless every character sets a port
 OLLAMA_API_URL = os.getenv('OLLAMA_API_URL', 'http://localhost:11434/v1/chat')
 SESSION_ID = USERNAME  # You can make this smarter: f"{USERNAME}_{date}" for multi-session
 
 JOURNAL_PATH = 'mud_journal.jsonl'
+GOAL_PATH = 'mud_journal.json'
 NUM_MEMORIES = 5  # Number of recent journal entries to inject
+JOURNAL_MAX_BYTES = int(os.getenv('JOURNAL_MAX_BYTES', str(50 * 1024 * 1024)))  # Rotate and gzip the journal past this size
+PROMPT_QUIET_PERIOD = float(os.getenv('MUD_PROMPT_QUIET', '0.15'))  # Debounce after a prompt, in seconds
+CONTEXT_TOKEN_BUDGET = int(os.getenv('CONTEXT_TOKEN_BUDGET', '8000'))  # Max estimated tokens sent per request
+CONTEXT_KEEP_TURNS = int(os.getenv('CONTEXT_KEEP_TURNS', '6'))  # Most recent turns always sent verbatim
+HISTORY_TAIL_MESSAGES = int(os.getenv('HISTORY_TAIL_MESSAGES', '200'))  # Messages loaded from Mongo at startup
+HISTORY_GAP_PAGES = 5  # Older pages fetched at most to reach the last turn already summarized
+PROMPT_LAYOUT = os.getenv('PROMPT_LAYOUT', LAYOUT_LEGACY)  # 'stable' keeps the prompt prefix cacheable
+LLM_STREAM = os.getenv('LLM_STREAM', '1') == '1'  # Stream replies and send game_input as soon as it is parsed
+LLM_CONCURRENCY = int(os.getenv('LLM_CONCURRENCY', '1'))  # Should match the server's parallel slots (OLLAMA_NUM_PARALLEL)
+REFLEX_RULES_PATH = os.getenv('REFLEX_RULES_PATH', 'reflexes.json')  # Extra local rules, see reflexes.py
+REFLEX_STATS_EVERY = 20  # Print reflex/LLM-bypass counters every N screens
+WORLD_MAP_PATH = os.getenv('WORLD_MAP_PATH', 'world_map.json')  # Room graph used by 'travel <room>'
+MEMORY_TOP_K = int(os.getenv('MEMORY_TOP_K', '3'))  # Older journal entries retrieved by similarity; 0 disables
+MEMORY_EMBEDDER = os.getenv('MEMORY_EMBEDDER', 'hashing')  # 'hashing' (offline) or 'ollama'
+OLLAMA_EMBED_URL = os.getenv('OLLAMA_EMBED_URL', 'http://localhost:11434/api/embed')
+OLLAMA_EMBED_MODEL = os.getenv('OLLAMA_EMBED_MODEL', 'nomic-embed-text')
+MEMORY_MAX_CHARS = 400  # Long session summaries are cut to this when injected
+TELNET_MCCP = os.getenv('TELNET_MCCP', '1') == '1'  # Accept zlib-compressed output when the server offers it
+TELNET_GMCP = os.getenv('TELNET_GMCP', '1') == '1'  # Structured vitals/room data over GMCP
+TELNET_MSDP = os.getenv('TELNET_MSDP', '1') == '1'  # ...or over MSDP
+SCREEN_COMPRESSION = os.getenv('SCREEN_COMPRESSION', '1') == '1'  # Dedupe seen rooms/paragraphs and repeated lines
+SCREEN_CHAR_BUDGET = int(os.getenv('SCREEN_CHAR_BUDGET', '6000'))  # Max characters of game output per turn; 0 disables
+# Resend a room description in full after this many turns. A "[room: X, seen]" reference only
+# helps while X's full text is still in the verbatim turns, so this is capped below CONTEXT_KEEP_TURNS.
+SCREEN_SEEN_TURNS = max(0, min(int(os.getenv('SCREEN_SEEN_TURNS', str(CONTEXT_KEEP_TURNS - 1))), CONTEXT_KEEP_TURNS - 1))
+LLM_DEEP_MODEL = os.getenv('LLM_DEEP_MODEL', 'deepseek-r1:32b')  # Thinking model for hard turns (and every turn without routing)
+LLM_FAST_MODEL = os.getenv('LLM_FAST_MODEL', '')  # e.g. 'gemma' built from the gemma Modelfile; empty disables routing
+ROUTER_GOAL_STALE_TURNS = int(os.getenv('ROUTER_GOAL_STALE_TURNS', '20'))  # Re-plan with the deep model after this many turns on one goal
+OUTBOUND_MIN_INTERVAL = float(os.getenv('OUTBOUND_MIN_INTERVAL', '0.2'))  # Seconds between the commands of a pipe burst
+OUTBOUND_SPLIT_PIPES = os.getenv('OUTBOUND_SPLIT_PIPES', '1') == '1'  # Send 'a|b|c' as paced separate lines
+STALE_OUTPUT_CHARS = int(os.getenv('STALE_OUTPUT_CHARS', '2000'))  # New output during an LLM call that makes its answer stale
+PENDING_SCREENS_MAX = 50  # Screens kept for the next turn while deferring
+MUD_MAX_BUFFER_CHARS = int(os.getenv('MUD_MAX_BUFFER_CHARS', '65536'))  # Unread output kept by the connection
+SESSION_LOG_FLUSH_BYTES = int(os.getenv('SESSION_LOG_FLUSH_BYTES', '65536'))  # Buffered log output written at once
+SESSION_LOG_FLUSH_INTERVAL = float(os.getenv('SESSION_LOG_FLUSH_INTERVAL', '2.0'))  # ...or after this many seconds
+SESSION_LOG_SEGMENT_BYTES = int(os.getenv('SESSION_LOG_SEGMENT_BYTES', str(8 * 1024 * 1024)))  # Rotate to a new segment past this
+SESSION_LOG_COMPRESSION = os.getenv('SESSION_LOG_COMPRESSION', 'gzip')  # 'gzip', 'zstd' (needs zstandard) or 'none'
+METRICS_PORT = int(os.getenv('METRICS_PORT', '0'))  # Serve Prometheus metrics on this port; 0 disables
+METRICS_TRACE_PATH = os.getenv('METRICS_TRACE_PATH', '')  # Append every timed span to this JSONL file
+
+state_publisher = StatePublisher(
+    mode=os.getenv('AI_STATE_MODE', 'off'),  # 'off', 'jsonl' or 'http'
+    path=os.getenv('AI_STATE_PATH', 'ai_state.jsonl'),
+    port=int(os.getenv('AI_STATE_PORT', '8765')),
+)
+
+# Phase timings and counters; see metrics.py
+metrics = Metrics(port=METRICS_PORT, trace_path=METRICS_TRACE_PATH or None)
+
+# One pooled HTTP session for every LLM request in the process
+http_session = requests.Session()
+http_session.mount('http://', requests.adapters.HTTPAdapter(pool_maxsize=max(LLM_CONCURRENCY, 10)))
+http_session.mount('https://', requests.adapters.HTTPAdapter(pool_maxsize=max(LLM_CONCURRENCY, 10)))
+
+def make_embedder():
+    if MEMORY_EMBEDDER == 'ollama':
+        return OllamaEmbedder(OLLAMA_EMBED_URL, OLLAMA_EMBED_MODEL, session=http_session)
+    return HashingEmbedder()
+
+# --------------- PER-CHARACTER STATE ---------------
+class Character:
+    """
+    Credentials and per-character state. main() plays the character configured
+    in .env; party_runner.py creates one per entry in its config file. The Mongo
+    client, HTTP session and history writer are shared.
+    """
+
+    def __init__(self, username, password, host=None, port=None, session_id=None,
+                 journal_path=JOURNAL_PATH, goal_path=GOAL_PATH, priority=0, world_map_path=WORLD_MAP_PATH):
+        self.username = username
+        self.password = password
+        self.host = host or MUD_HOST
+        self.port = port or MUD_PORT
+        if not self.host or not self.port:
+            raise ValueError(f"No MUD host/port for {username}: set MUD_HOST and MUD_PORT or give the character its own")
+        self.session_id = session_id or username
+        self.goal_path = goal_path
+        self.priority = priority  # Added to the turn priority; lower goes first
+        self.journal_path = journal_path
+        self.journal_store = JournalStore(journal_path, capacity=max(NUM_MEMORIES, 50), max_bytes=JOURNAL_MAX_BYTES)
+        self.memory_index = None
+        if MEMORY_TOP_K > 0:
+            if np is None:
+                print("[WARN] numpy is not installed; semantic memory retrieval is disabled.")
+            else:
+                self.memory_index = MemoryIndex(os.path.splitext(journal_path)[0] + '_index', make_embedder())
+        self.history_pager = HistoryPager(coll, self.session_id, page_size=HISTORY_TAIL_MESSAGES)
+        self.summary_store = SummaryStore(summary_coll, self.session_id)
+        self.context_window = ContextWindow(
+            token_budget=CONTEXT_TOKEN_BUDGET,
+            keep_turns=CONTEXT_KEEP_TURNS,
+            summary_store=self.summary_store,
+        )
+        self.reflexes = ReflexEngine(load_rules(REFLEX_RULES_PATH))
+        self.world = WorldMap(world_map_path)
+        self.router = ModelRouter(LLM_FAST_MODEL, LLM_DEEP_MODEL, ROUTER_GOAL_STALE_TURNS) if LLM_FAST_MODEL else None
+        self.compressor = ScreenCompressor(SCREEN_CHAR_BUDGET, SCREEN_SEEN_TURNS) if SCREEN_COMPRESSION else None
+
+# The .env character; built by main() so importing this module (party_runner.py)
+# does not open its journal, memory index and world map
+default_character = None
 
 # --------------- JOURNAL UTILITIES ---------------
-def append_journal_entry(journal_text, extra_fields=None):
+def append_journal_entry(journal_text, extra_fields=None, character=None):
+    character = character or default_character
     entry = {
         "timestamp": time.time(),
         "journal": journal_text
     }
     if extra_fields:
         entry.update(extra_fields)
-    with open(JOURNAL_PATH, "a", encoding="utf-8") as f:
-        f.write(json.dumps(entry, ensure_ascii=False) + "\n")
+    character.journal_store.append(entry)
+    if character.memory_index is not None:
+        try:
+            character.memory_index.add(journal_key(entry), journal_text)
+        except Exception as e:
+            print(f"[WARN] Could not index journal entry: {e}")
 
-def get_recent_journal_entries(n=NUM_MEMORIES):
-    if not os.path.exists(JOURNAL_PATH):
-        return []
+def get_recent_journal_entries(n=NUM_MEMORIES, character=None):
+    character = character or default_character
     try:
-        with open(JOURNAL_PATH, "r", encoding="utf-8") as f:
-            lines = f.readlines()[-n:]
-        return [json.loads(line)["journal"] for line in lines if line.strip()]
+        return [entry["journal"] for entry in character.journal_store.recent(n)]
     except Exception:
         return []
 
-def load_current_goal():
+def get_related_memories(screen, exclude=(), character=None):
+    """Older journal entries and session summaries most similar to the current screen."""
+    character = character or default_character
+    if character.memory_index is None:
+        return []
     try:
-        with open('mud_journal.json', 'r', encoding='utf-8') as jf:
+        related = character.memory_index.search(screen, MEMORY_TOP_K, exclude=set(exclude))
+    except Exception as e:
+        print(f"[WARN] Memory search failed: {e}")
+        return []
+    return [m if len(m) <= MEMORY_MAX_CHARS else m[:MEMORY_MAX_CHARS] + '...' for m in related]
+
+def screen_for_model(screen, state, compressor=None):
+    """
+    The screen text as the LLM sees it: ANSI codes and control characters
+    stripped, repeats compressed (see screen_compressor.py) and, when the server
+    sends structured state over GMCP/MSDP, that state as compact JSON. The
+    status prompt lines are dropped only when the state carries the vitals
+    they would duplicate.
+    """
+    text = strip_control(screen)
+    if state and state.vitals:
+        text = '\n'.join(line for line in text.split('\n') if not line.rstrip().endswith('>>'))
+    if compressor is not None:
+        text = compressor.compress(text)
+        stats = compressor.last_stats
+        print(f"\n[CMP] {stats['chars_in']} -> {stats['chars_out']} chars ({stats['ratio']:.0%}), "
+              f"{stats.get('rooms_seen', 0)} rooms seen, {stats.get('lines_collapsed', 0)} lines collapsed")
+    if not state:
+        return text
+    return f"<state>{state.to_prompt_json()}</state>\n" + text
+
+def load_current_goal(path=GOAL_PATH):
+    try:
+        with open(path, 'r', encoding='utf-8') as jf:
             journal = json.load(jf)
             return journal.get('goal', '')
     except Exception:
@@ -59,22 +222,46 @@ def load_current_goal():
 
 # --------------- MONGO CHAT HISTORY UTILITIES ---------------
 def save_message_to_db(message, session_id=SESSION_ID):
-    coll.insert_one({
+    # Written in batches by a background thread; see history_writer.py
+    history_writer.enqueue({
         "session_id": session_id,
         "timestamp": time.time(),
         "message": message
     })
 
-def load_chat_history_from_db(session_id=SESSION_ID):
-    msgs = list(coll.find({"session_id": session_id}).sort("timestamp", 1))
-    return [m['message'] for m in msgs]
+def load_chat_history_from_db(character=None, limit=HISTORY_TAIL_MESSAGES):
+    """
+    Load only the most recent `limit` messages. Turns older than that are
+    represented by the summaries stored for them, if any. Folding carries on
+    right after the newest summary; if that summary ends before the loaded
+    messages, older pages are fetched (up to HISTORY_GAP_PAGES) so the turns
+    in between are not left out of both.
+    """
+    character = character or default_character
+    pager = character.history_pager
+    summary_store = character.summary_store
+    context_window = character.context_window
+    messages = pager.load_tail(limit)
+    latest = summary_store.latest()
+    if latest and latest.get('last_turn'):
+        for _ in range(HISTORY_GAP_PAGES + 1):
+            if context_window.resume(messages, latest['last_turn']):
+                context_window.prior_summaries = summary_store.before(latest['created_at'], inclusive=True)
+                return messages
+            older = pager.older_page()
+            if not older:
+                break
+            messages = older + messages
+    if pager.oldest_timestamp is not None and not pager.exhausted:
+        context_window.prior_summaries = summary_store.before(pager.oldest_timestamp)
+    return messages
 
 # --------------- PROMPT & LLM ---------------
 base_system_prompt = """You are playing a live online MUD game. Respond ONLY with a JSON object containing **four fields**:
-- 'journal': keep a running journal of what you are doing in game to help you remember,
-- 'reasoning': your reasoning,
-- 'decision': your conclusion about your next action,
 - 'game_input': the command to send,
+- 'decision': your conclusion about your next action,
+- 'reasoning': your reasoning,
+- 'journal': keep a running journal of what you are doing in game to help you remember,
 
 
 You are an EXPERT MUD player.
@@ -92,6 +279,7 @@ Misc:	addquest, allow, bet, bug, check, delete, demote, dice, enlist, gain, gamb
 <tips>
 - you can send multiple commands at the same time by separating them each with a pipe | 
 - most characters are NPCs and don't respond to "say" or "tell" only specific commands such as "list" to see what they offer
+- to walk to a room you have already visited, send "travel <room name>" and the client will walk the whole route for you
 </tips>
 """
 
@@ -147,74 +335,142 @@ def clean_llm_json(content):
                     continue
             break
     # If we end up here, parsing failed
-    raise
-
-
-def get_ai_response(prompt, chat_history, current_goal):
-    # Build the system prompt, adding recent memories
-    recent_memories = get_recent_journal_entries(NUM_MEMORIES)
-    memories_text = ""
-    if recent_memories:
-        memories_text = "Here are your recent journal entries:\n" + "\n".join(f"- {m}" for m in recent_memories) + "\n"
-    system_prompt = (
-        base_system_prompt
-        + "\n\n"
-        + memories_text
-        + f"<goal>:\n{current_goal}\n</goal>\n"
-        + "Remember to keep your 'journal' updated each turn."
-    )
+    raise json.JSONDecodeError("Could not repair the model's JSON", content, 0)
+
+
+def parse_llm_reply(content, session=None):
+    """Parse the model's JSON, counting replies that needed clean_llm_json's repairs."""
+    with metrics.span('parse_json', session=session):
+        try:
+            parsed = json.loads(content)
+            if isinstance(parsed, dict):
+                return parsed
+        except json.JSONDecodeError:
+            pass
+        metrics.inc('json_repairs_total', session=session)
+        try:
+            return clean_llm_json(content)
+        except ValueError:
+            metrics.inc('parse_failures_total', session=session)
+            raise
+
+
+def count_llm_tokens(chunk, session=None, model=None):
+    """Token counters from the final chunk of an Ollama reply."""
+    metrics.inc('llm_requests_total', session=session, model=model)
+    if chunk:
+        metrics.inc('llm_prompt_tokens_total', chunk.get('prompt_eval_count') or 0, session=session, model=model)
+        metrics.inc('llm_completion_tokens_total', chunk.get('eval_count') or 0, session=session, model=model)
+
+
+def get_ai_response(prompt, chat_history, current_goal, on_game_input=None, character=None):
+    character = character or default_character
+    context_window = character.context_window
+    session = character.session_id
+    # Build the system prompt; the legacy layout puts recent memories in it
+    with metrics.span('memories', session=session):
+        recent_memories = get_recent_journal_entries(NUM_MEMORIES, character)
+        related_memories = get_related_memories(prompt, recent_memories, character)
+    system_prompt = system_prompt_for(PROMPT_LAYOUT, base_system_prompt, recent_memories, current_goal, related_memories)
 
     # Ensure system prompt is always the first message
     if not chat_history or chat_history[0].get('role') != "system":
         chat_history.insert(0, {"role": "system", "content": system_prompt})
-        save_message_to_db({"role": "system", "content": system_prompt})
+        save_message_to_db({"role": "system", "content": system_prompt}, character.session_id)
     else:
         chat_history[0]["content"] = system_prompt
         # Update in DB: For simplicity, we leave previous system prompt as-is
 
     chat_history.append({"role": "user", "content": prompt})
-    save_message_to_db({"role": "user", "content": prompt})
+    save_message_to_db({"role": "user", "content": prompt}, character.session_id)
 
-    # Optionally save context for web UI
-    try:
-        with open("ai_state.json", "w", encoding="utf-8") as f:
-            json.dump({
-                "prompt": prompt,
-                "chat_history": chat_history,
-                "ai_response": None
-            }, f, ensure_ascii=False, indent=2)
-    except Exception as e:
-        print(f"[WARN] Could not write ai_state.json: {e}")
+    # Publish the new prompt for the web UI (no-op unless AI_STATE_MODE is set)
+    state_publisher.publish("prompt", session_id=character.session_id, prompt=prompt, goal=current_goal)
 
+    with metrics.span('build_context', session=session):
+        messages = finalize_messages(
+            PROMPT_LAYOUT, context_window.build(chat_history), recent_memories, current_goal, related_memories
+        )
+    stats = context_window.last_stats
+    print(f"[CTX] ~{stats['tokens_sent']} tokens sent, ~{stats['tokens_saved']} saved "
+          f"({stats['summarized_turns']} turns summarized)")
+
+    # Routine turns go to the fast model when routing is enabled; see model_router.py
+    router = character.router
+    tier = None
+    model, think = LLM_DEEP_MODEL, True
+    if router is not None:
+        tier, reasons = router.route(prompt, current_goal)
+        model, think = router.model_for(tier)
+        print(f"[ROUTE] {tier} ({model})" + (f": {', '.join(reasons)}" if reasons else ''))
+
+    options, extra_fields = request_options(PROMPT_LAYOUT)
     payload = {
-        "model": "deepseek-r1:32b", 
-        "messages": chat_history,
+        "model": model,
+        "messages": messages,
         "format": {
             "type": "object",
+            # Ollama emits properties in this order; game_input comes first so
+            # streaming can send it while the rest of the reply is generated
             "properties": {
-                "journal": {"type": "string"},
-                "reasoning": {"type": "string"},
+                "game_input": {"type": "string"},
                 "decision": {"type": "string"},
-                "game_input": {"type": "string"}
-                
+                "reasoning": {"type": "string"},
+                "journal": {"type": "string"}
             },
-            "required": ["reasoning", "decision", "game_input", "journal"]
+            "required": ["game_input", "decision", "reasoning", "journal"]
         },
-        "options": {"temperature": 1.0},
+        "options": options,
         "stream": False,
-        "think": True
+        **extra_fields
     }
+    if think:
+        payload["think"] = True
 
     headers = {"Content-Type": "application/json"}
     url = OLLAMA_API_URL
 
-    response = requests.post(
-        url=url,
-        headers=headers,
-        data=json.dumps(payload)
-    )
-    response.raise_for_status()
-    response_text = response.text.strip()
+    request_started = time.perf_counter()
+    if LLM_STREAM:
+        # Hand game_input to the caller the moment its value is complete, while
+        # journal/reasoning keep streaming in.
+
+        def handle_field(key, value):
+            if key == 'game_input':
+                metrics.observe('first_action_seconds', time.perf_counter() - request_started, session=session)
+                if on_game_input:
+                    on_game_input(value if isinstance(value, str) else str(value))
+
+        with metrics.span('llm_request', session=session, model=model):
+            content, _, stream_parser, final_chunk = stream_chat(
+                url, payload, headers, on_field=handle_field, session=http_session
+            )
+        count_llm_tokens(final_chunk, session, model)
+        if router is not None:
+            router.record(tier, time.perf_counter() - request_started, final_chunk)
+        content = content.strip()
+        if not content:
+            print("[ERROR] Ollama streamed an empty response.")
+            return None
+        try:
+            parsed = parse_llm_reply(content, session)
+        except ValueError:
+            if router is not None:
+                router.parse_failed(tier)
+            if 'game_input' not in stream_parser.fields:
+                print("[ERROR] Could not parse the AI response:", content)
+                return None
+            parsed = stream_parser.fields
+        return record_ai_response(prompt, chat_history, content, parsed, character)
+
+    with metrics.span('llm_request', session=session, model=model):
+        response = http_session.post(
+            url=url,
+            headers=headers,
+            data=json.dumps(payload)
+        )
+        response.raise_for_status()
+        response_text = response.text.strip()
     try:
         match = re.search(r'\{.*\}', response_text, re.DOTALL)
         if not match:
@@ -222,6 +478,9 @@ def get_ai_response(prompt, chat_history, current_goal):
             raise ValueError("No JSON object found in response.")
 
         outer = json.loads(match.group(0))
+        count_llm_tokens(outer, session, model)
+        if router is not None:
+            router.record(tier, time.perf_counter() - request_started, outer)
         inner_content = outer.get("message", {}).get("content", "")
         content = inner_content.strip()
         
@@ -229,105 +488,253 @@ def get_ai_response(prompt, chat_history, current_goal):
             print("[ERROR] Ollama response content is empty. Full response:", response_text)
             return None
 
-        parsed = clean_llm_json(content)
-        chat_history.append({"role": "assistant", "content": content})
-        save_message_to_db({"role": "assistant", "content": content})
-
-        # Optionally save AI response for web UI
         try:
-            with open("ai_state.json", "w", encoding="utf-8") as f:
-                json.dump({
-                    "prompt": prompt,
-                    "chat_history": chat_history,
-                    "ai_response": parsed
-                }, f, ensure_ascii=False, indent=2)
-        except Exception as e:
-            print(f"[WARN] Could not write ai_state.json: {e}")
-
-        # Write the journal entry to disk
-        journal_entry = parsed.get('journal', '')
-        append_journal_entry(
-            journal_entry,
-            {
-                "reasoning": parsed.get('reasoning', ''),
-                "decision": parsed.get('decision', ''),
-                "input": parsed.get('game_input', '')
-            }
-        )
-
-        return parsed
+            parsed = parse_llm_reply(content, session)
+        except ValueError:
+            if router is not None:
+                router.parse_failed(tier)
+            # Same fallback as the streaming path: keep whatever fields are complete
+            fallback = IncrementalJSONParser()
+            fallback.feed(content)
+            if 'game_input' not in fallback.fields:
+                print("[ERROR] Could not parse the AI response:", content)
+                return None
+            parsed = fallback.fields
+        return record_ai_response(prompt, chat_history, content, parsed, character)
 
     except json.JSONDecodeError as e:
         print("JSON decode error:", e)
         raise
 
+
+def record_ai_response(prompt, chat_history, content, parsed, character):
+    """Append the reply to history, persist it and write the journal entry."""
+    with metrics.span('record_response', session=character.session_id):
+        return _record_ai_response(prompt, chat_history, content, parsed, character)
+
+
+def _record_ai_response(prompt, chat_history, content, parsed, character):
+    chat_history.append({"role": "assistant", "content": content})
+    save_message_to_db({"role": "assistant", "content": content}, character.session_id)
+
+    # Publish the response and parsed fields for the web UI
+    state_publisher.publish("response", session_id=character.session_id, prompt=prompt, content=content, ai_response=parsed)
+
+    # Write the journal entry to disk
+    journal_entry = parsed.get('journal', '')
+    append_journal_entry(
+        journal_entry,
+        {
+            "reasoning": parsed.get('reasoning', ''),
+            "decision": parsed.get('decision', ''),
+            "input": parsed.get('game_input', '')
+        },
+        character
+    )
+
+    return parsed
+
 # ------------------- MAIN GAME LOOP -------------------
-def main():
-    tn = None
-    log_file = None
+async def run_game(character=None, scheduler=None):
+    """
+    Play one character until the connection closes. With a scheduler (see
+    llm_scheduler.py) LLM calls wait for a slot shared with other characters.
+    """
+    character = character or default_character
+    conn = None
+    outbound = None
+    session_log = None
     try:
-        chat_history = load_chat_history_from_db()
-        current_goal = load_current_goal()
-
-        tn = telnetlib.Telnet(MUD_HOST, MUD_PORT)
-        print(f"Connected to {MUD_HOST}:{MUD_PORT}")
+        chat_history = load_chat_history_from_db(character)
+        current_goal = load_current_goal(character.goal_path)
+        if character.memory_index is not None:
+            added = await asyncio.to_thread(
+                sync_sources, character.memory_index, character.journal_path, character.goal_path
+            )
+            if added:
+                print(f"[INFO] Indexed {added} journal entries for memory retrieval.")
+
+        conn = MudConnection(character.host, character.port, quiet_period=PROMPT_QUIET_PERIOD,
+                             mccp=TELNET_MCCP, gmcp=TELNET_GMCP, msdp=TELNET_MSDP,
+                             max_buffer_chars=MUD_MAX_BUFFER_CHARS)
+        await conn.connect()
+        metrics.inc('connects_total', session=character.session_id)
+        print(f"Connected to {character.host}:{character.port}")
 
         timestamp = time.strftime("%Y%m%d-%H%M%S")
-        log_filename = f'{USERNAME}_mud_log_{timestamp}.txt'
-        log_file = open(log_filename, 'a', encoding='utf-8')
+        session_log = SessionLog(
+            f'{character.username}_mud_log_{timestamp}',
+            flush_bytes=SESSION_LOG_FLUSH_BYTES,
+            flush_interval=SESSION_LOG_FLUSH_INTERVAL,
+            segment_bytes=SESSION_LOG_SEGMENT_BYTES,
+            compression=SESSION_LOG_COMPRESSION,
+        )
 
         # Log non-secret environment variables at the top of the log file
         env_vars_to_log = {
-            'MUD_HOST': MUD_HOST,
-            'MUD_PORT': MUD_PORT,
-            'USERNAME': USERNAME,
-            'SESSION_ID': SESSION_ID
+            'MUD_HOST': character.host,
+            'MUD_PORT': character.port,
+            'USERNAME': character.username,
+            'SESSION_ID': character.session_id
         }
-        log_file.write("# Environment variables (non-secret):\n")
+        session_log.write("# Environment variables (non-secret):\n")
         for k, v in env_vars_to_log.items():
-            log_file.write(f"{k}={v}\n")
-        log_file.write("\n")
-        log_file.flush()
-
-        buffer_window = []
+            session_log.write(f"{k}={v}\n")
+        session_log.write("\n")
+
+        # Every screen since the last turn, merged into the next prompt
+        pending_screens = collections.deque(maxlen=PENDING_SCREENS_MAX)
+        outbound = CommandQueue(conn, min_interval=OUTBOUND_MIN_INTERVAL, split_pipes=OUTBOUND_SPLIT_PIPES,
+                                metrics=metrics, session=character.session_id)
+        outbound.start()
+        travel = None
+        notes = []
+        replanned = False
+        command_in_flight = False
         logged_in = False
         one_time_score_sent = False
         while True:
             # Send 'score' once after login when first prompt appears
             if not logged_in and not one_time_score_sent:
-                tn.write(b'score\n')
+                await conn.send('score')
                 one_time_score_sent = True
-                time.sleep(1)
-            data = tn.read_very_eager().decode('utf-8', errors='ignore')
+            burst_deferred = bool(pending_screens) and not outbound.settled()
+            with metrics.span('read_screen', session=character.session_id):
+                data, prompt_kind = await conn.read_until_prompt(
+                    timeout=outbound.max_wait if burst_deferred else None
+                )
+            if conn.closed and not data:
+                metrics.inc('disconnects_total', session=character.session_id)
+                print("[INFO] Connection closed by server.")
+                break
+            # The reply to a burst's last command may carry no prompt we can detect (a pager,
+            # a prompt split across reads); once outbound stops waiting for one, take the turn
+            settle_turn = burst_deferred and prompt_kind is None and outbound.settled()
 
             # Auto-continue if prompt is present
-            if '[Hit Return to continue]' in data:
-                tn.write(b'\n')
+            if prompt_kind == 'continue':
+                await conn.send('')
                 continue
 
-            if data:
+            if data or settle_turn:
                 print(data, end='')
-                if 'By what name do you wish to be known' in data or 'By what name do you wish to be remembered' in data:
-                    tn.write(USERNAME.encode('utf-8') + b'\n')
-                    print(f"Sending username: {USERNAME}\n")
+                if prompt_kind == 'username':
+                    await conn.send(character.username)
+                    print(f"Sending username: {character.username}\n")
                     continue
-                if 'Password:' in data:
-                    tn.write(PASSWORD.encode('utf-8') + b'\n')
+                if prompt_kind == 'password':
+                    await conn.send(character.password)
                     print(f"Sending password: ***\n")
                     logged_in = True
                     continue
 
-                log_file.write(data)
-                log_file.flush()
-                buffer_window.append(data)
-                if len(buffer_window) > 1:
-                    buffer_window.pop(0)
-                context = ''.join(buffer_window)
-                if '>>' in data:
-                    parsed = get_ai_response(context, chat_history, current_goal)
+                if prompt_kind == 'game' or settle_turn:
+                    session_log.mark_turn()
+                session_log.write(data)
+                if data:
+                    pending_screens.append(data)
+                if prompt_kind == 'game' or settle_turn:
+                    world = character.world
+                    rooms_known = len(world.rooms)
+                    events = world.observe(data, conn.state.room_id, conn.state.room.get('name'))
+                    if character.router is not None:
+                        character.router.observe_room(len(world.rooms) > rooms_known)
+                    world.save_if_due()
+                    if travel:
+                        # Walking a route locally; only wake the LLM on arrival, a blocked move or combat
+                        if COMBAT_PATTERN.search(strip_control(data)):
+                            note = f"[travel] Stopped walking to {travel.target} at {world.current_name()}: combat started."
+                        else:
+                            note = travel.update(world, events)
+                        if note is None:
+                            metrics.inc('turns_total', session=character.session_id, source='travel')
+                            continue
+                        print(f"\n\033[33m{note}\033[0m")
+                        travel = None
+                        outbound.cancel()
+                        notes.append(note)
+                    if not outbound.settled():
+                        # Output from the middle of a command burst; the last reply starts the next turn
+                        continue
+                    # Everything since the last turn, so a reflex never answers the last
+                    # chunk while a tell or a fight sits in an earlier one
+                    screens = merge_screens(pending_screens)
+                    context = screens
+                    reflex = None
+                    plain_screen = not notes
+                    if notes:
+                        context = '\n'.join(notes) + '\n' + context
+                        notes = []
+                    else:
+                        # Routine screens are answered locally without an LLM call
+                        with metrics.span('reflex_check', session=character.session_id):
+                            reflex = character.reflexes.check(screens, command_in_flight)
+                    if character.reflexes.stats["screens"] % REFLEX_STATS_EVERY == 0:
+                        print(f"\n[REFLEX] {character.reflexes.summary()}")
+                        if character.router is not None:
+                            print(f"[ROUTE] {character.router.summary()}")
+                    if reflex is not None:
+                        source = 'deferred' if reflex.command is None else reflex.source.split(':')[0]
+                        metrics.inc('turns_total', session=character.session_id, source=source)
+                        if reflex.command is None:
+                            continue  # Stays in pending_screens for the next turn
+                        print(f"\n\033[33m[Reflex {reflex.source}]: {reflex.command}\033[0m")
+                        session_log.write(f"Reflex input ({reflex.source}): {reflex.command}\n")
+                        world.sent(reflex.command)
+                        outbound.submit(reflex.command)
+                        pending_screens.clear()
+                        command_in_flight = True
+                        continue
+                    pending_screens.clear()
+                    command_in_flight = False
+                    turn_screen = context
+                    context = screen_for_model(context, conn.state, character.compressor)
+                    if character.compressor is not None:
+                        state_publisher.publish("compression", session_id=character.session_id,
+                                                **character.compressor.last_stats)
+
+                    # The LLM request blocks, so run it off the event loop; the
+                    # connection keeps reading into its buffer meanwhile.
+                    loop = asyncio.get_running_loop()
+                    dispatched = []
+                    stale = []
+
+                    def send_unless_stale(command):
+                        # If the game moved on while the model was thinking, its command is dropped and
+                        # the next turn re-plans from the new output (at most once in a row)
+                        reason = None if replanned else went_stale(turn_screen, conn.pending_output(), STALE_OUTPUT_CHARS)
+                        if reason:
+                            stale.append((command, reason))
+                            return
+                        world.sent(command)
+                        outbound.submit(command)
+
+                    def dispatch_game_input(command):
+                        if TRAVEL_PATTERN.match(command):
+                            return  # Planned locally once the reply is complete
+                        dispatched.append(command)
+                        loop.call_soon_threadsafe(send_unless_stale, command)
+
+                    ai_args = (context, chat_history, current_goal, dispatch_game_input, character)
+                    with metrics.span('llm_turn', session=character.session_id):
+                        try:
+                            if scheduler:
+                                priority = turn_priority(context, character.priority)
+                                parsed = await scheduler.run(priority, get_ai_response, *ai_args)
+                            else:
+                                parsed = await asyncio.to_thread(get_ai_response, *ai_args)
+                        except Exception:
+                            metrics.inc('llm_errors_total', session=character.session_id)
+                            metrics.inc('turns_total', session=character.session_id, source='llm_error')
+                            raise
                     if parsed is None:
+                        metrics.inc('llm_retries_total', session=character.session_id)
+                        metrics.inc('turns_total', session=character.session_id, source='llm_retry')
+                        if scheduler:
+                            print(f"[INFO] AI response unavailable for {character.username}; waiting for more output.")
+                            continue
                         print("[INFO] AI response unavailable. Press Enter to retry or Ctrl+C to exit.")
-                        input()
+                        await asyncio.to_thread(input)
                         continue
                     reasoning = parsed.get('reasoning', '')
                     decision = parsed.get('decision', '')
@@ -337,36 +744,104 @@ def main():
                     print(f"\033[32m[AI decision]: {decision}\033[0m")
                     print(f"\033[36m[AI input]: {game_input}\033[0m")
                     print(f"\033[34m[AI journal]: {journal}\033[0m")
-                    log_file.write(f"AI reasoning: {reasoning}\n")
-                    log_file.write(f"AI input: {game_input}\n")
-                    log_file.write(f"AI journal: {journal}\n")
-                    log_file.flush()
-                    tn.write(((game_input if game_input else '') + '\n').encode('utf-8'))
-            time.sleep(1)
-    except KeyboardInterrupt:
+                    session_log.write(f"AI reasoning: {reasoning}\nAI input: {game_input}\nAI journal: {journal}\n")
+                    travel_match = TRAVEL_PATTERN.match(game_input or '')
+                    if travel_match and not dispatched:
+                        target = travel_match.group(1)
+                        path = world.path_to(target)
+                        if path:
+                            travel = Travel(target, path)
+                            game_input = travel.command()
+                            print(f"\033[33m[travel] {target}: {game_input}\033[0m")
+                        else:
+                            notes.append(
+                                f"[travel] Already at {target}." if path == [] else
+                                f"[travel] No known route to {target}; walk there step by step."
+                            )
+                            game_input = 'look'
+                    if not dispatched:
+                        send_unless_stale(game_input)
+                    if stale:
+                        command, reason = stale[0]
+                        print(f"\n\033[33m[stale] Not sending '{command}': {reason}\033[0m")
+                        metrics.inc('stale_turns_total', session=character.session_id)
+                        metrics.inc('turns_total', session=character.session_id, source='llm_stale')
+                        notes.append(f"[stale] Your command '{command}' was not sent because {reason} "
+                                     f"while you were deciding; decide again from the new output.")
+                        travel = None
+                        replanned = True
+                        continue
+                    metrics.inc('turns_total', session=character.session_id, source='llm')
+                    replanned = False
+                    command_in_flight = True
+                    if plain_screen and not travel_match:
+                        # A travel route (or its 'look' fallback) depends on where we are going,
+                        # and a turn with notes on more than the screen, so neither is replayed
+                        # from the reflex cache
+                        character.reflexes.remember(screens, game_input)
+    except (KeyboardInterrupt, asyncio.CancelledError):
         print("\nGraceful shutdown requested. Closing connections...")
     finally:
-        if tn and log_file:
+        if conn and session_log and not conn.closed:
             try:
-                tn.write(b'score\n')
-                score_output = tn.read_until(b'> ', timeout=5).decode('utf-8', errors='ignore')
-                log_file.write(score_output)
-                log_file.flush()
+                await conn.send('score')
+                score_output, _ = await conn.read_until_prompt(timeout=5)
+                session_log.write(score_output)
                 print("[Shutdown] Sent 'score' and logged output.")
             except Exception as e:
                 print(f"[Shutdown] Failed to send 'score' or log output: {e}")
-        if tn:
+        if character.router is not None:
+            print(f"[ROUTE] {character.router.summary()}")
+        try:
+            character.world.save()
+        except Exception as e:
+            print(f"[Shutdown] Failed to save world map: {e}")
+        character.summary_store.close()
+        if outbound:
+            await outbound.close()
+        if conn:
             try:
-                tn.close()
+                await conn.close()
                 print("Telnet connection closed.")
             except Exception:
                 pass
-        if log_file:
+        if session_log:
             try:
-                log_file.close()
-                print("Log file closed.")
-            except Exception:
-                pass
+                session_log.close()
+                print(f"Session log closed ({session_log.index_path}).")
+            except Exception as e:
+                print(f"[Shutdown] Failed to close session log: {e}")
+
+def start_shared_services():
+    # Replays any spilled messages first so they show up in the history
+    history_writer.start()
+    state_publisher.start()
+    metrics.start()
+
+def stop_shared_services():
+    phases = metrics.phase_totals()
+    if phases:
+        print("[METRICS] " + ", ".join(
+            f"{phase} {count}x {total / count * 1000:.0f}ms" for phase, (count, total) in sorted(phases.items())
+        ))
+    metrics.close()
+    state_publisher.close()
+    try:
+        history_writer.close()
+        print("Chat history flushed.")
+    except Exception as e:
+        print(f"[Shutdown] Failed to flush chat history: {e}")
+
+def main():
+    global default_character
+    default_character = Character(USERNAME, PASSWORD, session_id=SESSION_ID)
+    start_shared_services()
+    try:
+        asyncio.run(run_game())
+    except KeyboardInterrupt:
+        pass
+    finally:
+        stop_shared_services()
 
 if __name__ == '__main__':
     main()
@@ -0,0 +1,193 @@
+import asyncio
+import collections
+import re
+import time
+
+from telnet_protocol import TelnetProtocol
+
+# Prompt kinds, checked against the last non-blank line of buffered output.
+PROMPT_PATTERNS = [
+    ("continue", re.compile(r"\[Hit Return to continue\]")),
+    ("username", re.compile(r"By what name do you wish to be (?:known|remembered)")),
+    ("password", re.compile(r"Password:")),
+    ("game", re.compile(r">>")),
+]
+
+DEFAULT_QUIET_PERIOD = 0.15  # seconds of silence after a prompt before we act on it
+DEFAULT_IDLE_FLUSH = 1.0  # hand back prompt-less output after this much silence
+DEFAULT_MAX_BUFFER_CHARS = 65536  # unread output kept while the client is busy; oldest is dropped first
+
+
+def detect_prompt(text):
+    """Return the prompt kind if the last non-blank line of text is a prompt, else None."""
+    for line in reversed(text.splitlines()):
+        if line.strip():
+            for kind, pattern in PROMPT_PATTERNS:
+                if pattern.search(line):
+                    return kind
+            return None
+    return None
+
+
+class MudConnection:
+    """
+    Event-driven telnet connection. A background task reads from the socket as
+    soon as bytes arrive; read_until_prompt() returns once a prompt line has
+    completed and the server has been quiet for `quiet_period` seconds.
+    Structured game state negotiated over GMCP/MSDP is kept in `self.state`.
+
+    Output that arrives while the client is busy (an LLM call) is kept as
+    timestamped chunks, at most `max_buffer_chars`, and handed back together by
+    the next read. prompt_count counts game prompts as they arrive, so the
+    outbound queue can pace commands at the server's rate.
+    """
+
+    def __init__(self, host, port, quiet_period=DEFAULT_QUIET_PERIOD,
+                 idle_flush=DEFAULT_IDLE_FLUSH, encoding="utf-8", mccp=True, gmcp=True, msdp=True,
+                 max_buffer_chars=DEFAULT_MAX_BUFFER_CHARS):
+        self.host = host
+        self.port = port
+        self.quiet_period = quiet_period
+        self.idle_flush = idle_flush
+        self.encoding = encoding
+        self.reader = None
+        self.writer = None
+        self.protocol = TelnetProtocol(mccp=mccp, gmcp=gmcp, msdp=msdp)
+        self.state = self.protocol.state
+        self.max_buffer_chars = max_buffer_chars
+        self._chunks = collections.deque()  # Unread text, oldest first
+        self._buffered_chars = 0
+        self._dropped_chars = 0
+        self._last_data_at = 0.0
+        self._data_event = asyncio.Event()
+        self._prompt_event = asyncio.Event()
+        self.prompt_count = 0
+        self.read_prompt_count = 0  # prompt_count when the last read returned
+        self._reader_task = None
+        self.closed = False
+
+    async def connect(self):
+        self.reader, self.writer = await asyncio.open_connection(self.host, self.port)
+        self._reader_task = asyncio.create_task(self._read_loop())
+
+    async def _read_loop(self):
+        try:
+            while True:
+                data = await self.reader.read(4096)
+                if not data:
+                    break
+                text, reply = self.protocol.feed(data)
+                if reply:
+                    self.writer.write(reply)
+                if text:
+                    self._append(text.decode(self.encoding, errors="ignore"))
+        except (ConnectionError, asyncio.IncompleteReadError) as e:
+            print(f"[WARN] Connection read failed: {e}")
+        finally:
+            self.closed = True
+            self._data_event.set()
+            self._prompt_event.set()
+
+    def _append(self, text):
+        self._chunks.append(text)
+        self._buffered_chars += len(text)
+        while self._buffered_chars > self.max_buffer_chars and len(self._chunks) > 1:
+            dropped = self._chunks.popleft()
+            self._buffered_chars -= len(dropped)
+            self._dropped_chars += len(dropped)
+        self._last_data_at = time.monotonic()
+        if text.strip() and detect_prompt(self._tail()) == "game":
+            self.prompt_count += 1
+            self._prompt_event.set()
+        self._data_event.set()
+
+    def _tail(self):
+        # A prompt line can straddle two reads
+        if len(self._chunks) > 1:
+            return self._chunks[-2] + self._chunks[-1]
+        return self._chunks[-1] if self._chunks else ""
+
+    def pending_output(self):
+        """Output received since the last read, without taking it."""
+        return ''.join(self._chunks)
+
+    def _take_buffer(self):
+        text = self.pending_output()
+        if self._dropped_chars:
+            text = f"[... {self._dropped_chars} chars of older output dropped ...]\n" + text
+        self._chunks.clear()
+        self._buffered_chars = 0
+        self._dropped_chars = 0
+        self.read_prompt_count = self.prompt_count
+        return text
+
+    async def wait_for_prompt(self, after_count, timeout):
+        """Wait until more than `after_count` game prompts have arrived; False on timeout."""
+        deadline = time.monotonic() + timeout
+        while self.prompt_count <= after_count and not self.closed:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return False
+            self._prompt_event.clear()
+            try:
+                await asyncio.wait_for(self._prompt_event.wait(), timeout=remaining)
+            except asyncio.TimeoutError:
+                return False
+        return self.prompt_count > after_count
+
+    async def read_until_prompt(self, timeout=None):
+        """
+        Wait for output and return (text, prompt_kind). prompt_kind is one of the
+        PROMPT_PATTERNS names, or None when output stopped without a prompt, the
+        timeout expired or the connection closed.
+        """
+        deadline = time.monotonic() + timeout if timeout is not None else None
+        while True:
+            now = time.monotonic()
+            if deadline is not None and now >= deadline:
+                return self._take_buffer(), None
+            if self.closed:
+                return self._take_buffer(), None
+
+            wait = None
+            if self._chunks:
+                quiet_for = now - self._last_data_at
+                kind = detect_prompt(self._tail())
+                if kind is not None:
+                    if quiet_for >= self.quiet_period:
+                        return self._take_buffer(), kind
+                    wait = self.quiet_period - quiet_for
+                else:
+                    if quiet_for >= self.idle_flush:
+                        return self._take_buffer(), None
+                    wait = self.idle_flush - quiet_for
+            if deadline is not None:
+                remaining = deadline - now
+                wait = remaining if wait is None else min(wait, remaining)
+
+            self._data_event.clear()
+            try:
+                await asyncio.wait_for(self._data_event.wait(), timeout=wait)
+            except asyncio.TimeoutError:
+                pass
+
+    async def send(self, text):
+        if self.closed or self.writer is None:
+            raise ConnectionError("MUD connection is closed")
+        self.writer.write((text + "\n").encode(self.encoding))
+        await self.writer.drain()
+
+    async def close(self):
+        if self._reader_task:
+            self._reader_task.cancel()
+            try:
+                await self._reader_task
+            except (asyncio.CancelledError, Exception):
+                pass
+        if self.writer:
+            self.writer.close()
+            try:
+                await self.writer.wait_closed()
+            except Exception:
+                pass
+        self.closed = True
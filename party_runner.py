@@ -0,0 +1,98 @@
+import argparse
+import asyncio
+import json
+import os
+
+from mud_client import (
+    LLM_CONCURRENCY,
+    Character,
+    run_game,
+    start_shared_services,
+    stop_shared_services,
+)
+from llm_scheduler import LLMScheduler
+
+PARTY_CONFIG = os.getenv('MUD_PARTY_CONFIG', 'party.json')
+PARTY_MAX_RESTARTS = int(os.getenv('MUD_PARTY_MAX_RESTARTS', '5'))  # Per character, before giving up on it
+PARTY_RESTART_DELAY = float(os.getenv('MUD_PARTY_RESTART_DELAY', '30'))  # Seconds before a failed character reconnects
+
+
+def load_party(path):
+    """
+    Read the party config. Each character needs a username and either a
+    password or a password_env naming the environment variable that holds it;
+    host, port, session_id, journal_path, goal_path, world_map_path and priority
+    are optional.
+    """
+    with open(path, 'r', encoding='utf-8') as f:
+        config = json.load(f)
+    characters = []
+    for entry in config.get('characters', []):
+        password = entry.get('password')
+        if password is None and entry.get('password_env'):
+            password = os.getenv(entry['password_env'])
+        username = entry['username']
+        characters.append(Character(
+            username,
+            password,
+            host=entry.get('host'),
+            port=entry.get('port'),
+            session_id=entry.get('session_id'),
+            journal_path=entry.get('journal_path', f'{username}_journal.jsonl'),
+            goal_path=entry.get('goal_path', 'mud_journal.json'),
+            priority=entry.get('priority', 0),
+            world_map_path=entry.get('world_map_path', f'{username}_world_map.json'),
+        ))
+    return characters, config.get('llm_concurrency', LLM_CONCURRENCY)
+
+
+async def run_character(character, scheduler, max_restarts=PARTY_MAX_RESTARTS, restart_delay=PARTY_RESTART_DELAY):
+    """
+    Play one party member. An error (an Ollama timeout, a dropped connection)
+    restarts that character after `restart_delay` instead of cancelling the
+    rest of the party; it is given up on after `max_restarts` failures.
+    """
+    failures = 0
+    while True:
+        try:
+            await run_game(character, scheduler)
+            return
+        except Exception as e:
+            failures += 1
+            print(f"[Party] {character.username} stopped: {type(e).__name__}: {e}")
+            if failures > max_restarts:
+                print(f"[Party] Giving up on {character.username} after {failures} failures.")
+                return
+            print(f"[Party] Restarting {character.username} in {restart_delay:g}s ({failures}/{max_restarts}).")
+            await asyncio.sleep(restart_delay)
+
+
+async def run_party(characters, concurrency):
+    scheduler = LLMScheduler(max_concurrent=concurrency)
+    try:
+        await asyncio.gather(*(run_character(character, scheduler) for character in characters))
+    finally:
+        print(f"[Party] LLM scheduler stats: {scheduler.stats}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run several MUD characters on one event loop.")
+    parser.add_argument('config', nargs='?', default=PARTY_CONFIG)
+    args = parser.parse_args()
+
+    characters, concurrency = load_party(args.config)
+    if not characters:
+        print(f"No characters configured in {args.config}")
+        return
+    print(f"[Party] Starting {len(characters)} characters with {concurrency} LLM slot(s)")
+    start_shared_services()
+    try:
+        asyncio.run(run_party(characters, concurrency))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        stop_shared_services()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,61 @@
+import os
+
+# "legacy" rebuilds the system prompt with memories and goal every turn.
+# "stable" keeps the system prompt byte-identical and appends everything that
+# changes per turn to the final user message, so the server's prompt-prefix
+# (KV) cache covers the whole conversation up to the newest turn.
+LAYOUT_LEGACY = 'legacy'
+LAYOUT_STABLE = 'stable'
+
+JOURNAL_REMINDER = "Remember to keep your 'journal' updated each turn."
+
+OLLAMA_KEEP_ALIVE = os.getenv('OLLAMA_KEEP_ALIVE', '30m')  # Keep the model (and its cache) loaded between turns
+OLLAMA_NUM_CTX = int(os.getenv('OLLAMA_NUM_CTX', '16384'))  # Fixed so the runner is never reloaded with a new size
+
+
+def memories_text(memories, related=None):
+    text = ""
+    if related:
+        text += "Older memories related to what you see now:\n" + "\n".join(f"- {m}" for m in related) + "\n"
+    if memories:
+        text += "Here are your recent journal entries:\n" + "\n".join(f"- {m}" for m in memories) + "\n"
+    return text
+
+
+def system_prompt_for(layout, base_prompt, memories, goal, related=None):
+    if layout == LAYOUT_STABLE:
+        return base_prompt + "\n\n" + JOURNAL_REMINDER
+    return (
+        base_prompt
+        + "\n\n"
+        + memories_text(memories, related)
+        + f"<goal>:\n{goal}\n</goal>\n"
+        + JOURNAL_REMINDER
+    )
+
+
+def finalize_messages(layout, messages, memories, goal, related=None):
+    """
+    Return the messages to send. In the stable layout the memories and goal are
+    placed in front of the game output inside the last user message; the stored
+    history keeps only the raw game output, so earlier turns never change.
+    """
+    if layout != LAYOUT_STABLE or not messages or messages[-1].get('role') != 'user':
+        return messages
+    last = messages[-1]
+    content = (
+        memories_text(memories, related)
+        + f"<goal>:\n{goal}\n</goal>\n\n"
+        + f"<game>\n{last.get('content', '')}\n</game>"
+    )
+    return messages[:-1] + [{**last, 'content': content}]
+
+
+def request_options(layout, temperature=1.0):
+    """Return (options, extra_payload_fields) for the chat request."""
+    options = {"temperature": temperature}
+    extra = {}
+    if layout == LAYOUT_STABLE:
+        options["num_ctx"] = OLLAMA_NUM_CTX
+        extra["keep_alive"] = OLLAMA_KEEP_ALIVE
+    return options, extra
@@ -0,0 +1,179 @@
+import collections
+import json
+import os
+import re
+import time
+
+from llm_scheduler import COMBAT_PATTERN
+from telnet_protocol import ANSI_PATTERN
+
+PROMPT_LINE_PATTERN = re.compile(r'>>\s*$')
+ERROR_PATTERN = re.compile(
+    r"^(?:Huh\?|What\?|Alas, you cannot go that way|You can't|You cannot|You don't see|"
+    r"You do not see|They aren't here|You don't have|You do not have)",
+    re.IGNORECASE | re.MULTILINE,
+)
+
+# A rule response of None defers the screen: nothing is sent and its text is
+# merged into the next screen the LLM sees. Only used while a command is in
+# flight, otherwise the bot would sit waiting for output that never comes.
+DEFER = None
+
+DEFAULT_RULES = [
+    {
+        # Tick messages that carry nothing to act on by themselves
+        "name": "status_tick",
+        "pattern": r"^(?:You are (?:hungry|thirsty)\.|The sun (?:rises|slowly disappears)[^.]*\.|"
+                   r"The (?:day|night) has begun\.|It (?:starts|stopped) (?:to )?rain(?:ing)?\.|"
+                   r"The (?:rain|lightning) (?:stopped|has stopped)\.|The sky is (?:getting )?cloudy\.|"
+                   r"The clouds disappear\.)$",
+        "response": DEFER,
+        "whole_screen": True,
+        "priority": 10,
+    },
+]
+
+
+def normalize_screen(text):
+    """
+    Cache key for a screen: no ANSI, numbers masked (gold, timers), whitespace
+    collapsed. Prompt lines keep their numbers, so an answer learned at full
+    health is not replayed at low health.
+    """
+    lines = []
+    for line in ANSI_PATTERN.sub('', text).splitlines():
+        lines.append(line if PROMPT_LINE_PATTERN.search(line) else re.sub(r'\d+', '#', line))
+    return ' '.join(' '.join(lines).split())
+
+
+def content_lines(text):
+    """Non-blank lines of a screen, without ANSI codes and without the prompt line."""
+    lines = [line.strip() for line in ANSI_PATTERN.sub('', text).splitlines()]
+    return [line for line in lines if line and not PROMPT_LINE_PATTERN.search(line)]
+
+
+class Rule:
+    """
+    A compiled trigger. `response` is the command to send (a string, which may
+    use \\1-style group references), or DEFER. With `whole_screen` every content
+    line of the screen must match, otherwise a match anywhere fires the rule.
+    """
+
+    def __init__(self, name, pattern, response, priority=0, cooldown=0.0, whole_screen=False):
+        self.name = name
+        self.pattern = re.compile(pattern, re.IGNORECASE | re.MULTILINE)
+        self.response = response
+        self.priority = priority
+        self.cooldown = cooldown
+        self.whole_screen = whole_screen
+
+    def match(self, screen):
+        if self.whole_screen:
+            lines = content_lines(screen)
+            if lines and all(self.pattern.search(line) for line in lines):
+                return self.pattern.search(lines[0])
+            return None
+        return self.pattern.search(ANSI_PATTERN.sub('', screen))
+
+
+class Reflex:
+    def __init__(self, command, source):
+        self.command = command
+        self.source = source
+
+
+def load_rules(path=None):
+    """DEFAULT_RULES plus any rules from a JSON list at `path`, same shape as DEFAULT_RULES."""
+    specs = list(DEFAULT_RULES)
+    if path and os.path.exists(path):
+        with open(path, 'r', encoding='utf-8') as f:
+            specs.extend(json.load(f))
+    return [Rule(**spec) for spec in specs]
+
+
+class ReflexEngine:
+    """
+    Answer routine screens before they reach the LLM: first the rules, highest
+    priority first, then a cache of previous LLM answers keyed by the normalized
+    screen. A cached answer is dropped if the game replies with an error. So that
+    cached answers cannot loop, a screen answered from the cache within the last
+    `recent_keys` cache hits goes to the LLM, as does every screen after
+    `max_cache_streak` cache hits in a row. Combat screens are never cached.
+    """
+
+    def __init__(self, rules=None, cache_size=512, max_cache_streak=3, recent_keys=8):
+        self.rules = sorted(rules if rules is not None else load_rules(), key=lambda r: -r.priority)
+        self.cache_size = cache_size
+        self.max_cache_streak = max_cache_streak
+        self._cache = collections.OrderedDict()
+        self._last_fired = {}
+        self._recent_keys = collections.deque(maxlen=recent_keys)
+        self._cache_streak = 0
+        self._pending_key = None
+        self.stats = collections.Counter()
+
+    def check(self, screen, command_in_flight=False):
+        """Return a Reflex for this screen, or None if the LLM should handle it."""
+        self.stats["screens"] += 1
+        key = normalize_screen(screen)
+
+        # The previous answer led to an error: don't repeat it next time
+        if self._pending_key is not None and ERROR_PATTERN.search(ANSI_PATTERN.sub('', screen)):
+            self._cache.pop(self._pending_key, None)
+            self.stats["cache_invalidations"] += 1
+        self._pending_key = None
+
+        now = time.monotonic()
+        for rule in self.rules:
+            if rule.cooldown and now - self._last_fired.get(rule.name, float('-inf')) < rule.cooldown:
+                continue
+            match = rule.match(screen)
+            if not match:
+                continue
+            if rule.response is DEFER:
+                if not command_in_flight:
+                    continue
+                self._last_fired[rule.name] = now
+                self.stats["deferred"] += 1
+                return Reflex(DEFER, f"rule:{rule.name}")
+            self._last_fired[rule.name] = now
+            self.stats["rule_hits"] += 1
+            return Reflex(match.expand(rule.response), f"rule:{rule.name}")
+
+        command = self._cache.get(key)
+        if (command is not None and key not in self._recent_keys
+                and self._cache_streak < self.max_cache_streak
+                and not COMBAT_PATTERN.search(ANSI_PATTERN.sub('', screen))):
+            self._cache.move_to_end(key)
+            self._recent_keys.append(key)
+            self._cache_streak += 1
+            self._pending_key = key
+            self.stats["cache_hits"] += 1
+            return Reflex(command, "cache")
+
+        self._cache_streak = 0
+        self.stats["llm_calls"] += 1
+        return None
+
+    def remember(self, screen, command):
+        """Cache the LLM's answer for this screen, unless it is a fight."""
+        if not command or COMBAT_PATTERN.search(ANSI_PATTERN.sub('', screen)):
+            return
+        key = normalize_screen(screen)
+        self._cache[key] = command
+        self._cache.move_to_end(key)
+        self._pending_key = key
+        while len(self._cache) > self.cache_size:
+            self._cache.popitem(last=False)
+
+    @property
+    def bypass_rate(self):
+        screens = self.stats["screens"]
+        if not screens:
+            return 0.0
+        return (self.stats["rule_hits"] + self.stats["cache_hits"] + self.stats["deferred"]) / screens
+
+    def summary(self):
+        return (f"{self.stats['screens']} screens, {self.stats['rule_hits']} rule, "
+                f"{self.stats['cache_hits']} cache, {self.stats['deferred']} deferred, "
+                f"{self.stats['llm_calls']} LLM ({self.bypass_rate:.0%} bypassed)")
@@ -0,0 +1,171 @@
+import collections
+import hashlib
+
+from world_map import EXITS_PATTERN, find_room_name
+
+# Blocks shorter than this are cheap to resend and often carry the news (a
+# tell, a hit), so only longer paragraphs are replaced by references.
+MIN_PARAGRAPH_CHARS = 120
+
+
+def fingerprint(lines):
+    text = ' '.join(' '.join(line.split()) for line in lines).lower()
+    return hashlib.sha1(text.encode('utf-8')).hexdigest()
+
+
+def merge_screens(screens):
+    """
+    Join the screens that piled up since the last turn, oldest first, folding
+    runs of identical screens (a repeated tick, a spammed channel) into one.
+    """
+    merged = []
+    for screen in screens:
+        key = ' '.join(screen.split())
+        if merged and merged[-1][0] == key:
+            merged[-1][2] += 1
+        else:
+            merged.append([key, screen, 1])
+    parts = []
+    for _, screen, count in merged:
+        if count > 1:
+            screen = f"{screen.rstrip()} (screen repeated x{count})"
+        if parts and not parts[-1].endswith('\n'):
+            parts[-1] += '\n'  # A screen usually ends on its prompt line
+        parts.append(screen)
+    return ''.join(parts)
+
+
+class ScreenCompressor:
+    """
+    Shrink screen text before it is sent to the LLM and stored in the history.
+    Room descriptions already shown within the last `seen_turns` turns become
+    "[room: <name>, seen]", other long paragraphs seen before become
+    "[repeat: <start>..., seen]", runs of identical adjacent lines collapse
+    into one line with a count, and the result is cut to `char_budget` characters,
+    keeping the newest output. Per-turn and running ratios are in last_stats
+    and totals.
+    """
+
+    def __init__(self, char_budget=6000, seen_turns=5, capacity=2048):
+        self.char_budget = char_budget
+        self.seen_turns = seen_turns
+        self.capacity = capacity
+        self.turn = 0
+        self._seen = collections.OrderedDict()  # fingerprint -> turn it was last sent in full
+        self.last_stats = {}
+        self.totals = collections.Counter()
+
+    def _recently_seen(self, key):
+        turn = self._seen.get(key)
+        if turn is not None and self.turn - turn <= self.seen_turns:
+            return True
+        self._seen[key] = self.turn
+        self._seen.move_to_end(key)
+        while len(self._seen) > self.capacity:
+            self._seen.popitem(last=False)
+        return False
+
+    def _rooms(self, lines, stats):
+        """Replace the name and description of already-seen rooms, keeping the exits line."""
+        out = []
+        block = []
+        for line in lines:
+            if not EXITS_PATTERN.match(line):
+                block.append(line)
+                continue
+            # The room starts at its name, found the way world_map.parse_screen finds it
+            lower = 0
+            for i, candidate in enumerate(block):
+                if not candidate.strip() or '>>' in candidate:
+                    lower = i + 1
+            start = find_room_name(block, lower, len(block))
+            if start is None:
+                start = len(block)
+            room = block[start:]
+            if room and self._recently_seen('room:' + fingerprint(room)):
+                out.extend(block[:start])
+                out.append(f"[room: {room[0].strip()}, seen]")
+                stats['rooms_seen'] += 1
+            else:
+                out.extend(block)
+            out.append(line)
+            block = []
+        out.extend(block)
+        return out
+
+    def _paragraphs(self, lines, stats):
+        """Replace long blank-line separated paragraphs that were sent before."""
+        out = []
+        paragraph = []
+
+        def flush():
+            text_len = sum(len(line) for line in paragraph)
+            if (len(paragraph) > 1 and text_len >= MIN_PARAGRAPH_CHARS
+                    and not any(line.startswith('[room:') for line in paragraph)
+                    and self._recently_seen('para:' + fingerprint(paragraph))):
+                start = ' '.join(paragraph[0].split())[:40]
+                out.append(f"[repeat: {start}..., seen]")
+                stats['paragraphs_seen'] += 1
+            else:
+                out.extend(paragraph)
+            paragraph.clear()
+
+        for line in lines:
+            if line.strip():
+                paragraph.append(line)
+            else:
+                flush()
+                out.append(line)
+        flush()
+        return out
+
+    def _collapse(self, lines, stats):
+        """
+        Fold runs of identical adjacent lines into one line marked with the run
+        length. Only neighbours are merged, so events keep their order and the
+        last prompt line on the screen is still the last line sent.
+        """
+        out = []
+        run_key = None
+        run_count = 0
+        for line in lines:
+            key = line.strip()
+            if not key:
+                run_key = None
+                if out and not out[-1].strip():
+                    continue  # Runs of blank lines
+                out.append(line)
+                continue
+            if key == run_key:
+                run_count += 1
+                out[-1] = f"{line} (x{run_count})"
+                stats['lines_collapsed'] += 1
+                continue
+            run_key = key
+            run_count = 1
+            out.append(line)
+        return out
+
+    def compress(self, text):
+        self.turn += 1
+        stats = collections.Counter()
+        lines = text.split('\n')
+        lines = self._rooms(lines, stats)
+        lines = self._paragraphs(lines, stats)
+        lines = self._collapse(lines, stats)
+        result = '\n'.join(lines)
+        if self.char_budget and len(result) > self.char_budget:
+            cut = len(result) - self.char_budget
+            result = f"[... {cut} chars of older output omitted ...]\n" + result[cut:]
+            stats['chars_truncated'] = cut
+        stats['chars_in'] = len(text)
+        stats['chars_out'] = len(result)
+        self.totals.update(stats)
+        self.last_stats = dict(stats, ratio=len(result) / len(text) if text else 1.0)
+        return result
+
+    @property
+    def overall_ratio(self):
+        if not self.totals['chars_in']:
+            return 1.0
+        return self.totals['chars_out'] / self.totals['chars_in']
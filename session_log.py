@@ -0,0 +1,272 @@
+import glob
+import gzip
+import json
+import os
+import threading
+import time
+
+try:
+    import zstandard
+except ImportError:  # zstd segments are optional; gzip is always available
+    zstandard = None
+
+COMPRESS_GZIP = 'gzip'
+COMPRESS_ZSTD = 'zstd'
+COMPRESS_NONE = 'none'
+
+SEGMENT_SUFFIXES = ('.txt.gz', '.txt.zst', '.log')  # Finished segments first, then the one being written
+INDEX_SUFFIX = '.index.jsonl'
+
+
+def segment_path(stem, segment, suffix):
+    return f"{stem}.{segment:03d}{suffix}"
+
+
+def find_segment(stem, segment):
+    for suffix in SEGMENT_SUFFIXES:
+        path = segment_path(stem, segment, suffix)
+        if os.path.exists(path):
+            return path
+    return None
+
+
+def open_segment(path):
+    """Open a segment for binary reading, whatever its compression."""
+    if path.endswith('.gz'):
+        return gzip.open(path, 'rb')
+    if path.endswith('.zst'):
+        if zstandard is None:
+            raise RuntimeError(f"zstandard is not installed; cannot read {path}")
+        return zstandard.open(path, 'rb')
+    return open(path, 'rb')
+
+
+def compress_file(src, dst, method):
+    tmp = dst + '.tmp'
+    with open(src, 'rb') as fin:
+        if method == COMPRESS_ZSTD:
+            with zstandard.open(tmp, 'wb') as fout:
+                while chunk := fin.read(1 << 20):
+                    fout.write(chunk)
+        else:
+            with gzip.open(tmp, 'wb', compresslevel=6) as fout:
+                while chunk := fin.read(1 << 20):
+                    fout.write(chunk)
+    os.replace(tmp, dst)
+    os.remove(src)
+
+
+class SessionLog:
+    """
+    Session log for one game session, written in segments:
+
+    - `<stem>.NNN.log`: the segment being written, plain text. Writes are
+      buffered in memory and reach the file in one write once `flush_bytes`
+      are pending or `flush_interval` seconds have passed.
+    - `<stem>.NNN.txt.gz` (or .txt.zst): a finished segment. A segment is
+      finished once it holds `segment_bytes`, and is then compressed by a
+      background thread.
+    - `<stem>.index.jsonl`: a sidecar index. It gets one {"turn", "segment",
+      "offset", "time"} line per mark_turn(), where offset is the uncompressed
+      byte offset in that segment. When a segment is finished it also gets a
+      {"segment", "file", "bytes", "lines"} line.
+
+    iter_lines() and read_turns() read a session back without loading it whole.
+    """
+
+    def __init__(self, stem, flush_bytes=64 * 1024, flush_interval=2.0,
+                 segment_bytes=8 * 1024 * 1024, compression=COMPRESS_GZIP, encoding='utf-8'):
+        if compression == COMPRESS_ZSTD and zstandard is None:
+            print("[WARN] zstandard is not installed; compressing session logs with gzip.")
+            compression = COMPRESS_GZIP
+        self.stem = stem
+        self.flush_bytes = flush_bytes
+        self.flush_interval = flush_interval
+        self.segment_bytes = segment_bytes
+        self.compression = compression
+        self.encoding = encoding
+        self.index_path = stem + INDEX_SUFFIX
+        self.segment = 0
+        self.turn = 0
+        self._segment_bytes = 0  # Bytes in the current segment, including the unflushed buffer
+        self._segment_lines = 0
+        self._buffer = []
+        self._buffer_bytes = 0
+        self._index_buffer = []
+        self._flushed_at = time.monotonic()
+        self._file = open(segment_path(stem, 0, '.log'), 'ab')
+        self._compressors = []
+        self.closed = False
+
+    def write(self, text):
+        data = text.encode(self.encoding)
+        self._buffer.append(data)
+        self._buffer_bytes += len(data)
+        self._segment_bytes += len(data)
+        self._segment_lines += text.count('\n')
+        if self._buffer_bytes >= self.flush_bytes or time.monotonic() - self._flushed_at >= self.flush_interval:
+            self.flush()
+
+    def mark_turn(self):
+        """Record that a new turn starts at the current position; returns its number."""
+        self.turn += 1
+        self._index_buffer.append({
+            "turn": self.turn, "segment": self.segment, "offset": self._segment_bytes, "time": time.time(),
+        })
+        return self.turn
+
+    def flush(self):
+        if self._buffer:
+            self._file.write(b''.join(self._buffer))
+            self._file.flush()
+            self._buffer = []
+            self._buffer_bytes = 0
+        if self._index_buffer:
+            with open(self.index_path, 'a', encoding='utf-8') as f:
+                f.write(''.join(json.dumps(entry) + "\n" for entry in self._index_buffer))
+            self._index_buffer = []
+        self._flushed_at = time.monotonic()
+        if self._segment_bytes >= self.segment_bytes:
+            self._rotate()
+
+    def _finish_segment(self, background):
+        self._file.close()
+        src = segment_path(self.stem, self.segment, '.log')
+        record = {"segment": self.segment, "bytes": self._segment_bytes, "lines": self._segment_lines}
+        if self.compression == COMPRESS_NONE:
+            record["file"] = os.path.basename(src)
+            self._index_buffer.append(record)
+            return
+        suffix = '.txt.zst' if self.compression == COMPRESS_ZSTD else '.txt.gz'
+        dst = segment_path(self.stem, self.segment, suffix)
+        record["file"] = os.path.basename(dst)
+        self._index_buffer.append(record)
+        if background:
+            thread = threading.Thread(target=compress_file, args=(src, dst, self.compression),
+                                      name="session-log-compress", daemon=True)
+            thread.start()
+            self._compressors.append(thread)
+        else:
+            compress_file(src, dst, self.compression)
+
+    def _rotate(self):
+        self._finish_segment(background=True)
+        self.segment += 1
+        self._segment_bytes = 0
+        self._segment_lines = 0
+        self._file = open(segment_path(self.stem, self.segment, '.log'), 'ab')
+
+    def close(self):
+        if self.closed:
+            return
+        self.flush()
+        if self._segment_bytes == 0 and self.segment > 0:
+            # Rotation just opened this segment; nothing was written to it
+            self._file.close()
+            os.remove(segment_path(self.stem, self.segment, '.log'))
+        else:
+            self._finish_segment(background=False)
+        self.flush()
+        for thread in self._compressors:
+            thread.join()
+        self.closed = True
+
+
+# ------------------------------ readers ------------------------------
+def session_stem(index_path):
+    return index_path[:-len(INDEX_SUFFIX)] if index_path.endswith(INDEX_SUFFIX) else index_path
+
+
+def load_index(index_path):
+    """Return (turns, segments): turn entries in order and {segment: record} for finished segments."""
+    turns = []
+    segments = {}
+    with open(index_path, 'r', encoding='utf-8') as f:
+        for line in f:
+            try:
+                entry = json.loads(line)
+            except json.JSONDecodeError:
+                continue  # A torn last line from a crash
+            if "turn" in entry:
+                turns.append(entry)
+            elif "segment" in entry:
+                segments[entry["segment"]] = entry
+    return turns, segments
+
+
+def session_segments(stem):
+    """Paths of the session's segments in order."""
+    paths = []
+    segment = 0
+    while True:
+        path = find_segment(stem, segment)
+        if path is None:
+            return paths
+        paths.append(path)
+        segment += 1
+
+
+def session_files(index_path):
+    stem = session_stem(index_path)
+    return session_segments(stem) + [index_path]
+
+
+def iter_lines(index_path, encoding='utf-8'):
+    """Stream a session's text line by line across its segments."""
+    partial = b''  # Segments are cut by size, so a line can continue in the next one
+    for path in session_segments(session_stem(index_path)):
+        with open_segment(path) as f:
+            for line in f:
+                if not line.endswith(b'\n'):
+                    partial += line
+                    continue
+                yield (partial + line).decode(encoding, errors='ignore')
+                partial = b''
+    if partial:
+        yield partial.decode(encoding, errors='ignore')
+
+
+def count_lines(index_path):
+    """Line count from the index, reading only a segment that was never finished."""
+    stem = session_stem(index_path)
+    _, segments = load_index(index_path)
+    total = 0
+    for segment, path in enumerate(session_segments(stem)):
+        if segment in segments:
+            total += segments[segment]["lines"]
+        else:
+            with open_segment(path) as f:
+                total += sum(chunk.count(b'\n') for chunk in iter(lambda: f.read(1 << 20), b''))
+    return total
+
+
+def read_turns(index_path, start, stop=None, encoding='utf-8'):
+    """Text of turns start..stop-1 (1-based, as numbered by mark_turn), seeking straight to the first."""
+    stem = session_stem(index_path)
+    turns, _ = load_index(index_path)
+    by_number = {t["turn"]: t for t in turns}
+    if start not in by_number:
+        return ''
+    begin = by_number[start]
+    end = by_number.get(stop) if stop is not None else None
+    parts = []
+    segment = begin["segment"]
+    offset = begin["offset"]
+    while True:
+        path = find_segment(stem, segment)
+        if path is None:
+            break
+        with open_segment(path) as f:
+            f.seek(offset)
+            if end is not None and end["segment"] == segment:
+                parts.append(f.read(end["offset"] - offset))
+                break
+            parts.append(f.read())
+        segment += 1
+        offset = 0
+    return b''.join(parts).decode(encoding, errors='ignore')
+
+
+def find_sessions(directory='.', pattern='*_mud_log_*'):
+    """Index files of segmented sessions in `directory`."""
+    return sorted(glob.glob(os.path.join(directory, pattern + INDEX_SUFFIX)))
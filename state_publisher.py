@@ -0,0 +1,114 @@
+import collections
+import itertools
+import json
+import queue
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+MODE_OFF = 'off'
+MODE_JSONL = 'jsonl'
+MODE_HTTP = 'http'
+
+
+class StatePublisher:
+    """
+    Publish per-turn state deltas (new prompt, new response, parsed fields) for
+    the web UI without touching the game loop: publish() only enqueues, and a
+    background thread does the I/O.
+
+    - 'jsonl': each event is appended to `path` as one line, written whole and
+      flushed, so a reader that only consumes complete lines never sees a torn one.
+    - 'http': the last `backlog` events are served from http://host:port/events;
+      pass ?since=<seq> to get only newer ones.
+    - 'off': publish() does nothing.
+    """
+
+    def __init__(self, mode=MODE_OFF, path='ai_state.jsonl', host='127.0.0.1', port=8765, backlog=500):
+        self.mode = mode
+        self.path = path
+        self.host = host
+        self.port = port
+        self._events = collections.deque(maxlen=backlog)
+        self._events_lock = threading.Lock()
+        self._queue = queue.Queue()
+        self._seq = itertools.count(1)
+        self._thread = None
+        self._server = None
+
+    def start(self):
+        if self.mode == MODE_OFF or self._thread:
+            return
+        if self.mode == MODE_HTTP:
+            self._server = ThreadingHTTPServer((self.host, self.port), self._make_handler())
+            threading.Thread(target=self._server.serve_forever, name="state-http", daemon=True).start()
+            print(f"[INFO] Publishing AI state on http://{self.host}:{self.port}/events")
+        self._thread = threading.Thread(target=self._run, name="state-publisher", daemon=True)
+        self._thread.start()
+
+    def publish(self, event_type, **fields):
+        if self.mode == MODE_OFF:
+            return
+        if not self._thread:
+            self.start()
+        self._queue.put({"seq": next(self._seq), "time": time.time(), "type": event_type, **fields})
+
+    def _run(self):
+        out = open(self.path, "a", encoding="utf-8") if self.mode == MODE_JSONL else None
+        try:
+            while True:
+                event = self._queue.get()
+                if event is None:
+                    break
+                if out:
+                    try:
+                        out.write(json.dumps(event, ensure_ascii=False) + "\n")
+                        out.flush()
+                    except (OSError, TypeError, ValueError) as e:
+                        print(f"[WARN] Could not publish AI state: {e}")
+                else:
+                    with self._events_lock:
+                        self._events.append(event)
+        finally:
+            if out:
+                out.close()
+
+    def events_since(self, seq):
+        with self._events_lock:
+            return [e for e in self._events if e["seq"] > seq]
+
+    def _make_handler(self):
+        publisher = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                url = urlparse(self.path)
+                if url.path != "/events":
+                    self.send_error(404)
+                    return
+                try:
+                    since = int(parse_qs(url.query).get("since", ["0"])[0])
+                except ValueError:
+                    since = 0
+                body = json.dumps(publisher.events_since(since), ensure_ascii=False, default=str).encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.send_header("Access-Control-Allow-Origin", "*")
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        return Handler
+
+    def close(self):
+        if self._thread:
+            self._queue.put(None)
+            self._thread.join(timeout=5)
+            self._thread = None
+        if self._server:
+            self._server.shutdown()
+            self._server = None
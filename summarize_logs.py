@@ -1,8 +1,13 @@
 import os
 import json
 import re
+import hashlib
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 import requests
 from dotenv import load_dotenv
+from session_log import INDEX_SUFFIX, count_lines, find_sessions, iter_lines, session_files, session_stem
 
 # Load environment variables from .env file
 load_dotenv()
@@ -14,11 +19,103 @@ OPENROUTER_MODEL = os.getenv('OPENROUTER_MODEL')
 LOG_DIR = '.'  # Current directory
 LOG_PATTERN = re.compile(r'.*_mud_log_.*\\.txt$|.*_mud_log_.*\.txt$', re.IGNORECASE)
 
+CHUNK_TOKENS = int(os.getenv('SUMMARY_CHUNK_TOKENS', '6000'))  # Max estimated tokens per summarize request
+CHARS_PER_TOKEN = 4
+SUMMARY_CONCURRENCY = int(os.getenv('SUMMARY_CONCURRENCY', '4'))  # Requests in flight at once
+SUMMARY_RATE_PER_MIN = float(os.getenv('SUMMARY_RATE_PER_MIN', '20'))  # Max requests started per minute
+SUMMARY_CACHE_PATH = os.getenv('SUMMARY_CACHE_PATH', 'summary_cache.json')
+SUMMARY_CACHE_SAVE_INTERVAL = float(os.getenv('SUMMARY_CACHE_SAVE_INTERVAL', '60'))  # Seconds between cache saves mid-run
+SUMMARY_MAX_PENDING = 2 * SUMMARY_CONCURRENCY  # Chunks read ahead of the workers
+
 SUMMARY_PROMPT = """
 You are Arvandor a human warrior. write your journal entry based on the following log. stay in character be detailed and concise."
 """
 
-def summarize_log(log_text):
+REDUCE_PROMPT = """
+You are Arvandor a human warrior. The following are your journal notes for consecutive parts of one play session, in order. Merge them into a single journal entry for the whole session. stay in character be detailed and concise.
+"""
+
+class RateLimiter:
+    """Space request starts at least 60/rate_per_min seconds apart across threads."""
+    def __init__(self, rate_per_min):
+        self.interval = 60.0 / rate_per_min if rate_per_min > 0 else 0
+        self._next = 0.0
+        self._lock = threading.Lock()
+
+    def wait(self):
+        with self._lock:
+            now = time.monotonic()
+            start = max(now, self._next)
+            self._next = start + self.interval
+        if start > now:
+            time.sleep(start - now)
+
+class SummaryCache:
+    """
+    Summaries keyed by a SHA-256 of the prompt and text, persisted to a JSON
+    file every `save_interval` seconds while summaries come in, and by save().
+    """
+    def __init__(self, path, save_interval=0):
+        self.path = path
+        self.save_interval = save_interval
+        self._saved_at = time.monotonic()
+        self._lock = threading.Lock()
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                self._data = json.load(f)
+        except (OSError, json.JSONDecodeError):
+            self._data = {}
+
+    @staticmethod
+    def key(prompt, text):
+        return hashlib.sha256((prompt + "\0" + text).encode('utf-8')).hexdigest()
+
+    def get(self, key):
+        with self._lock:
+            return self._data.get(key)
+
+    def put(self, key, summary):
+        with self._lock:
+            self._data[key] = summary
+            due = self.save_interval and time.monotonic() - self._saved_at >= self.save_interval
+        if due:
+            self.save()
+
+    def save(self):
+        with self._lock:
+            tmp_path = self.path + '.tmp'
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump(self._data, f)
+            os.replace(tmp_path, self.path)
+            self._saved_at = time.monotonic()
+
+def iter_chunks(log_text, max_tokens=CHUNK_TOKENS):
+    """
+    Yield chunks of a log of at most max_tokens (estimated), on line
+    boundaries. log_text may be a string or an iterable of lines, so a log can
+    be streamed from disk without holding the whole file.
+    """
+    max_chars = max_tokens * CHARS_PER_TOKEN
+    current = []
+    size = 0
+    lines = log_text.splitlines(keepends=True) if isinstance(log_text, str) else log_text
+    for line in lines:
+        while len(line) > max_chars:
+            # A single enormous line; cut it rather than overflow the request
+            if current:
+                yield ''.join(current)
+                current, size = [], 0
+            yield line[:max_chars]
+            line = line[max_chars:]
+        if size + len(line) > max_chars and current:
+            yield ''.join(current)
+            current, size = [], 0
+        current.append(line)
+        size += len(line)
+    if current:
+        yield ''.join(current)
+
+def summarize_log(log_text, system_prompt=SUMMARY_PROMPT):
     headers = {
         "Content-Type": "application/json",
         "Authorization": f"Bearer {OPENROUTER_API_KEY}"
@@ -28,11 +125,11 @@ def summarize_log(log_text):
         "type": "text",
         "temperature": 0.7,
         "messages": [
-            {"role": "system", "content": SUMMARY_PROMPT},
+            {"role": "system", "content": system_prompt},
             {"role": "user", "content": log_text}
         ]
     }
-    response = requests.post(OPENROUTER_API_URL, headers=headers, data=json.dumps(payload))
+    response = http_session.post(OPENROUTER_API_URL, headers=headers, data=json.dumps(payload))
     response.raise_for_status()
     # Just return the text content
     resp_json = response.json()
@@ -40,6 +137,90 @@ def summarize_log(log_text):
         return resp_json['choices'][0]['message']['content'].strip()
     return response.text.strip()
 
+http_session = requests.Session()
+rate_limiter = RateLimiter(SUMMARY_RATE_PER_MIN)
+
+def cached_summarize(cache, text, system_prompt=SUMMARY_PROMPT):
+    key = SummaryCache.key(system_prompt, text)
+    summary = cache.get(key)
+    if summary is None:
+        rate_limiter.wait()
+        summary = summarize_log(text, system_prompt)
+        cache.put(key, summary)
+    return summary
+
+def reduce_summaries(cache, summaries):
+    """Merge chunk summaries in order, in several rounds if they do not fit one request."""
+    while len(summaries) > 1:
+        merged = []
+        for group in split_summaries(summaries):
+            if len(group) == 1:
+                merged.append(group[0])
+            else:
+                text = "\n\n".join(f"Part {i + 1}:\n{s}" for i, s in enumerate(group))
+                merged.append(cached_summarize(cache, text, REDUCE_PROMPT))
+        if len(merged) == len(summaries):
+            # Nothing could be combined; give up rather than loop
+            return "\n\n".join(merged)
+        summaries = merged
+    return summaries[0]
+
+def split_summaries(summaries, max_tokens=CHUNK_TOKENS):
+    max_chars = max_tokens * CHARS_PER_TOKEN
+    groups = [[]]
+    size = 0
+    for summary in summaries:
+        if groups[-1] and size + len(summary) > max_chars:
+            groups.append([])
+            size = 0
+        groups[-1].append(summary)
+        size += len(summary)
+    return groups
+
+def summarize_logs_parallel(cache, logs, max_pending=SUMMARY_MAX_PENDING):
+    """
+    Map-reduce summaries for {fname: log_text or iterable of lines}: every chunk of every log is
+    summarized concurrently (bounded by SUMMARY_CONCURRENCY and the rate limit),
+    then each log's chunk summaries are merged. Chunks are read only
+    `max_pending` ahead of the workers, so streamed logs are never held whole.
+    Returns {fname: summary or Exception}.
+    """
+    results = {}
+    slots = threading.BoundedSemaphore(max_pending)
+
+    def summarize_chunk(chunk):
+        try:
+            return cached_summarize(cache, chunk)
+        finally:
+            slots.release()
+
+    with ThreadPoolExecutor(max_workers=SUMMARY_CONCURRENCY) as pool:
+        chunk_futures = {}
+        for fname, log_text in logs.items():
+            futures = chunk_futures[fname] = []
+            try:
+                for chunk in iter_chunks(log_text):
+                    slots.acquire()
+                    futures.append(pool.submit(summarize_chunk, chunk))
+            except OSError as e:
+                results[fname] = e
+        reduce_futures = {}
+        for fname, futures in chunk_futures.items():
+            if fname in results:
+                continue
+            try:
+                summaries = [f.result() for f in futures]
+            except Exception as e:
+                results[fname] = e
+                continue
+            reduce_futures[fname] = pool.submit(reduce_summaries, cache, summaries)
+        for fname, future in reduce_futures.items():
+            try:
+                results[fname] = future.result()
+            except Exception as e:
+                results[fname] = e
+    return results
+
 def get_new_goal(summaries, current_goal=None):
     prompt = """
 You are Arvandor, a human warrior in Abandoned Realms. Based on the following journal summaries of your recent MUD sessions, and your current goal (if any), describe your new main goal for the next session. If there is no current goal, infer one from the summaries. Be specific and actionable Both short and long term goal. Speak in first person as you are Arvandor. This is an in game goal. Speak in first person and in character Focus on the most recent journal entry.
@@ -62,13 +243,45 @@ You are Arvandor, a human warrior in Abandoned Realms. Based on the following jo
             {"role": "system", "content": prompt}
         ]
     }
-    response = requests.post(OPENROUTER_API_URL, headers=headers, data=json.dumps(payload))
+    response = http_session.post(OPENROUTER_API_URL, headers=headers, data=json.dumps(payload))
     response.raise_for_status()
     resp_json = response.json()
     if 'choices' in resp_json:
         return resp_json['choices'][0]['message']['content'].strip()
     return response.text.strip()
 
+def find_logs(log_dir=LOG_DIR):
+    """
+    {name: path} for every session log: single-file *_mud_log_*.txt logs and
+    segmented sessions (see session_log.py), named by their stem.
+    """
+    logs = {fname: os.path.join(log_dir, fname) for fname in os.listdir(log_dir) if LOG_PATTERN.match(fname)}
+    for index_path in find_sessions(log_dir):
+        logs[os.path.basename(session_stem(index_path))] = index_path
+    return logs
+
+def log_order(name, path):
+    """Sessions in play order: by the timestamp in the name, else by modification time."""
+    match = re.search(r'(\d{8}-\d{6})', name)
+    return (match.group(1) if match else '', os.path.getmtime(path))
+
+def read_log_lines(path):
+    if path.endswith(INDEX_SUFFIX):
+        yield from iter_lines(path)
+        return
+    with open(path, 'r', encoding='utf-8', errors='ignore') as f:
+        yield from f
+
+def log_line_count(path):
+    if path.endswith(INDEX_SUFFIX):
+        return count_lines(path)
+    with open(path, 'rb') as f:
+        return sum(chunk.count(b'\n') for chunk in iter(lambda: f.read(1 << 20), b''))
+
+def delete_log(path):
+    for file_path in (session_files(path) if path.endswith(INDEX_SUFFIX) else [path]):
+        os.remove(file_path)
+
 def main():
     journal_path = 'mud_journal.json'
     # Load existing journal if it exists
@@ -80,52 +293,56 @@ def main():
     else:
         current_goal = None
         all_entries = []
-    # Get all log files, sorted by creation time (oldest first)
-    log_files = [fname for fname in os.listdir(LOG_DIR) if LOG_PATTERN.match(fname)]
-    log_files = sorted(log_files, key=lambda f: os.path.getctime(os.path.join(LOG_DIR, f)))
+    # Entries by log file, in journal order; the list is rebuilt from this once at the end
+    entries_by_file = {entry.get('log_file') or f'#{i}': entry for i, entry in enumerate(all_entries)}
+    # Get all session logs, oldest first
+    logs = find_logs()
+    log_files = sorted(logs, key=lambda name: log_order(name, logs[name]))
+    to_summarize = {}
     for fname in log_files:
-        # Find existing entry for this log file, if any
-        entry_idx = next((i for i, entry in enumerate(all_entries) if entry.get('log_file') == fname), None)
-        existing_entry = all_entries[entry_idx] if entry_idx is not None else None
+        existing_entry = entries_by_file.get(fname)
         # Skip if already summarized and not empty
         if existing_entry and existing_entry.get('journal_entry'):
             print(f"Skipping {fname} (already summarized and complete)...")
             continue
-        # Check line count before processing
-        with open(fname, 'r', encoding='utf-8', errors='ignore') as f:
-            lines = f.readlines()
-        if len(lines) < 100:
+        # Check line count before processing; segmented sessions keep it in their index
+        if log_line_count(logs[fname]) < 100:
             print(f"Deleting {fname} (less than 100 lines)...")
-            os.remove(fname)
+            delete_log(logs[fname])
             # Remove entry if it exists
-            if entry_idx is not None:
-                all_entries.pop(entry_idx)
+            entries_by_file.pop(fname, None)
             continue
-        log_text = ''.join(lines)
         print(f"Summarizing {fname}...")
-        try:
-            summary = summarize_log(log_text)
-            match = re.search(r'(\d{8})-(\d{6})', fname)
-            if match:
-                date_str = match.group(1)
-                time_str = match.group(2)
-                date = f"{date_str[:4]}-{date_str[4:6]}-{date_str[6:]}"
-                time = f"{time_str[:2]}:{time_str[2:4]}:{time_str[4:]}"
-            else:
-                date = ''
-                time = ''
-            journal_entry = {
-                "date": date,
-                "time": time,
-                "log_file": fname,
-                "journal_entry": summary
-            }
-            if existing_entry:
-                all_entries[entry_idx] = journal_entry
-            else:
-                all_entries.append(journal_entry)
-        except Exception as e:
-            print(f"Failed to summarize {fname}: {e}")
+        to_summarize[fname] = read_log_lines(logs[fname])
+
+    cache = SummaryCache(SUMMARY_CACHE_PATH, save_interval=SUMMARY_CACHE_SAVE_INTERVAL)
+    try:
+        results = summarize_logs_parallel(cache, to_summarize) if to_summarize else {}
+    finally:
+        cache.save()
+    for fname in to_summarize:
+        summary = results.get(fname)
+        if isinstance(summary, Exception) or summary is None:
+            print(f"Failed to summarize {fname}: {summary}")
+            continue
+        match = re.search(r'(\d{8})-(\d{6})', fname)
+        if match:
+            date_str = match.group(1)
+            time_str = match.group(2)
+            date = f"{date_str[:4]}-{date_str[4:6]}-{date_str[6:]}"
+            time_of_day = f"{time_str[:2]}:{time_str[2:4]}:{time_str[4:]}"
+        else:
+            date = ''
+            time_of_day = ''
+        journal_entry = {
+            "date": date,
+            "time": time_of_day,
+            "log_file": fname,
+            "journal_entry": summary
+        }
+        # Replacing a key keeps its place; new sessions go at the end
+        entries_by_file[fname] = journal_entry
+    all_entries = list(entries_by_file.values())
     # Update the goal using the LLM
     if all_entries:
         new_goal = get_new_goal(all_entries, current_goal)
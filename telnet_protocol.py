@@ -0,0 +1,310 @@
+import json
+import re
+import zlib
+
+# Telnet command bytes (RFC 854). telnetlib was removed in Python 3.13, so the
+# protocol is handled here directly.
+IAC = 255
+DONT = 254
+DO = 253
+WONT = 252
+WILL = 251
+SB = 250
+SE = 240
+
+# Options we accept when the server offers them
+OPT_MSDP = 69
+OPT_MCCP2 = 86
+OPT_GMCP = 201
+
+# MSDP framing bytes
+MSDP_VAR = 1
+MSDP_VAL = 2
+MSDP_TABLE_OPEN = 3
+MSDP_TABLE_CLOSE = 4
+MSDP_ARRAY_OPEN = 5
+MSDP_ARRAY_CLOSE = 6
+
+MSDP_REPORT_VARIABLES = [
+    "CHARACTER_NAME", "HEALTH", "HEALTH_MAX", "MANA", "MANA_MAX", "MOVEMENT", "MOVEMENT_MAX",
+    "LEVEL", "EXPERIENCE", "MONEY", "OPPONENT_NAME", "OPPONENT_HEALTH", "OPPONENT_HEALTH_MAX",
+    "ROOM_NAME", "ROOM_EXITS", "AREA_NAME", "ROOM",
+]
+GMCP_SUPPORTS = ["Core 1", "Char 1", "Char.Vitals 1", "Char.Status 1", "Room 1", "Comm 1"]
+
+# CSI (colours, cursor movement), OSC (titles) and lone escapes, then other C0 controls
+ANSI_PATTERN = re.compile(r'\x1b(?:\[[0-?]*[ -/]*[@-~]|\][^\x07\x1b]*(?:\x07|\x1b\\)|[@-Z\\-_])')
+CONTROL_PATTERN = re.compile(r'[\x00-\x08\x0b-\x1f\x7f]')
+
+
+def strip_control(text):
+    """Remove ANSI escape sequences and control characters, keeping newlines and tabs."""
+    text = ANSI_PATTERN.sub('', text)
+    text = text.replace('\r\n', '\n').replace('\n\r', '\n')
+    return CONTROL_PATTERN.sub('', text)
+
+
+def parse_msdp(data):
+    """Decode an MSDP subnegotiation payload into a dict."""
+    pos = 0
+
+    def read_value():
+        nonlocal pos
+        if pos < len(data) and data[pos] == MSDP_TABLE_OPEN:
+            pos += 1
+            table = {}
+            while pos < len(data) and data[pos] != MSDP_TABLE_CLOSE:
+                if data[pos] == MSDP_VAR:
+                    pos += 1
+                    name = read_string()
+                    table[name] = read_vals()
+                else:
+                    pos += 1
+            pos += 1
+            return table
+        if pos < len(data) and data[pos] == MSDP_ARRAY_OPEN:
+            pos += 1
+            items = []
+            while pos < len(data) and data[pos] != MSDP_ARRAY_CLOSE:
+                if data[pos] == MSDP_VAL:
+                    pos += 1
+                    items.append(read_value())
+                else:
+                    pos += 1
+            pos += 1
+            return items
+        return read_string()
+
+    def read_vals():
+        nonlocal pos
+        values = []
+        while pos < len(data) and data[pos] == MSDP_VAL:
+            pos += 1
+            values.append(read_value())
+        if not values:
+            return ''
+        return values[0] if len(values) == 1 else values
+
+    def read_string():
+        nonlocal pos
+        start = pos
+        while pos < len(data) and data[pos] > MSDP_ARRAY_CLOSE:
+            pos += 1
+        return data[start:pos].decode('utf-8', errors='ignore')
+
+    result = {}
+    while pos < len(data):
+        if data[pos] == MSDP_VAR:
+            pos += 1
+            name = read_string()
+            result[name] = read_vals()
+        else:
+            pos += 1
+    return result
+
+
+def msdp_command(name, values):
+    out = bytearray([IAC, SB, OPT_MSDP, MSDP_VAR]) + name.encode()
+    for value in values:
+        out += bytes([MSDP_VAL]) + value.encode()
+    return bytes(out + bytes([IAC, SE]))
+
+
+def gmcp_command(package, data=None):
+    payload = package if data is None else f"{package} {json.dumps(data)}"
+    return bytes([IAC, SB, OPT_GMCP]) + payload.encode('utf-8').replace(b'\xff', b'\xff\xff') + bytes([IAC, SE])
+
+
+class GameState:
+    """Structured vitals, room and combat state from GMCP/MSDP, compact enough for the prompt."""
+
+    def __init__(self):
+        self.vitals = {}
+        self.room = {}
+        self.combat = {}
+        self.other = {}
+
+    def __bool__(self):
+        return bool(self.vitals or self.room or self.combat)
+
+    @property
+    def room_id(self):
+        """The server's number for the current room (GMCP num/id, MSDP vnum), if it sends one."""
+        for key in ('num', 'vnum', 'id'):
+            if self.room.get(key) not in (None, '', -1, '-1'):
+                return str(self.room[key])
+        return None
+
+    def update_gmcp(self, package, data):
+        package = package.lower()
+        if package in ('char.vitals', 'char.status', 'char.stats') and isinstance(data, dict):
+            self.vitals.update(data)
+        elif package in ('room.info', 'room') and isinstance(data, dict):
+            self.room = {k: v for k, v in data.items() if k in ('name', 'area', 'exits', 'num', 'id', 'environment')}
+        elif package.startswith('char.enemies') or package.startswith('char.combat'):
+            self.combat = data if isinstance(data, dict) else {"enemies": data}
+        else:
+            self.other[package] = data
+
+    def update_msdp(self, variables):
+        for name, value in variables.items():
+            key = name.lower()
+            if key.startswith('opponent'):
+                self.combat[key[len('opponent_'):] or key] = value
+            elif key == 'room' and isinstance(value, dict):
+                self.room = {k.lower(): v for k, v in value.items() if k.upper() in ('NAME', 'AREA', 'EXITS', 'VNUM')}
+            elif key.startswith('room_') or key == 'area_name':
+                self.room[key.replace('room_', '')] = value
+            else:
+                self.vitals[key] = value
+        if not self.combat.get('name'):
+            self.combat = {}
+
+    def to_prompt_json(self):
+        state = {}
+        if self.vitals:
+            state['vitals'] = self.vitals
+        if self.room:
+            state['room'] = self.room
+        if self.combat:
+            state['combat'] = self.combat
+        return json.dumps(state, separators=(',', ':'), ensure_ascii=False)
+
+
+class TelnetProtocol:
+    """
+    Incremental telnet parser. feed() takes raw socket bytes and returns
+    (text_bytes, reply_bytes): the game text with all negotiation removed and
+    whatever we need to send back. MCCP2 compression, GMCP and MSDP are accepted
+    when offered (and enabled); every other option is refused, as telnetlib did.
+    """
+
+    def __init__(self, mccp=True, gmcp=True, msdp=True, client_name="mud-llm-client"):
+        self.accept = set()
+        if mccp:
+            self.accept.add(OPT_MCCP2)
+        if gmcp:
+            self.accept.add(OPT_GMCP)
+        if msdp:
+            self.accept.add(OPT_MSDP)
+        self.client_name = client_name
+        self.state = GameState()
+        self.enabled = set()
+        self._pending = b""
+        self._inflate = None
+        self.compressed_bytes = 0
+        self.raw_bytes = 0
+
+    def feed(self, data):
+        self.raw_bytes += len(data)
+        if self._inflate is not None:
+            data = self._decompress(data)
+        data = self._pending + data
+        self._pending = b""
+        out = bytearray()
+        reply = bytearray()
+        i = 0
+        n = len(data)
+        while i < n:
+            b = data[i]
+            if b != IAC:
+                out.append(b)
+                i += 1
+                continue
+            if i + 1 >= n:
+                self._pending = data[i:]
+                break
+            cmd = data[i + 1]
+            if cmd == IAC:
+                out.append(IAC)
+                i += 2
+            elif cmd in (DO, DONT, WILL, WONT):
+                if i + 2 >= n:
+                    self._pending = data[i:]
+                    break
+                reply += self._negotiate(cmd, data[i + 2])
+                i += 3
+            elif cmd == SB:
+                end = self._find_se(data, i + 2)
+                if end == -1:
+                    self._pending = data[i:]
+                    break
+                option = data[i + 2] if i + 2 < end else None
+                payload = data[i + 3:end].replace(b'\xff\xff', b'\xff')
+                i = end + 2
+                if option == OPT_MCCP2:
+                    # Everything after IAC SE is a zlib stream
+                    self._inflate = zlib.decompressobj()
+                    rest_text, rest_reply = self._feed_rest(data[i:])
+                    out += rest_text
+                    reply += rest_reply
+                    break
+                self._subnegotiation(option, payload)
+            else:
+                i += 2
+        return bytes(out), bytes(reply)
+
+    def _feed_rest(self, data):
+        """Process bytes that arrived after compression started in the same chunk."""
+        self.raw_bytes -= len(data)  # already counted
+        return self.feed(data)
+
+    def _decompress(self, data):
+        self.compressed_bytes += len(data)
+        try:
+            plain = self._inflate.decompress(data)
+        except zlib.error as e:
+            print(f"[WARN] MCCP stream error, compression disabled: {e}")
+            self._inflate = None
+            return data
+        if self._inflate.eof:
+            # Server ended compression; the rest of the chunk is plain again
+            plain += self._inflate.unused_data
+            self._inflate = None
+            self.enabled.discard(OPT_MCCP2)
+        return plain
+
+    @staticmethod
+    def _find_se(data, start):
+        i = start
+        while True:
+            i = data.find(bytes([IAC]), i)
+            if i == -1 or i + 1 >= len(data):
+                return -1
+            if data[i + 1] == SE:
+                return i
+            i += 2  # IAC IAC (escaped 255) or another command inside SB
+
+    def _negotiate(self, cmd, option):
+        if cmd == WILL:
+            if option in self.accept:
+                if option in self.enabled:
+                    return b""
+                self.enabled.add(option)
+                return bytes([IAC, DO, option]) + self._hello(option)
+            return bytes([IAC, DONT, option])
+        if cmd == DO:
+            return bytes([IAC, WONT, option])
+        if cmd == WONT:
+            self.enabled.discard(option)
+        return b""
+
+    def _hello(self, option):
+        if option == OPT_GMCP:
+            return (gmcp_command("Core.Hello", {"client": self.client_name, "version": "1"})
+                    + gmcp_command("Core.Supports.Set", GMCP_SUPPORTS))
+        if option == OPT_MSDP:
+            return msdp_command("REPORT", MSDP_REPORT_VARIABLES)
+        return b""
+
+    def _subnegotiation(self, option, payload):
+        if option == OPT_GMCP:
+            text = payload.decode('utf-8', errors='ignore').strip()
+            package, _, body = text.partition(' ')
+            try:
+                data = json.loads(body) if body else None
+            except json.JSONDecodeError:
+                data = body
+            self.state.update_gmcp(package, data)
+        elif option == OPT_MSDP:
+            self.state.update_msdp(parse_msdp(payload))
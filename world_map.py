@@ -0,0 +1,342 @@
+import collections
+import hashlib
+import json
+import os
+import re
+import time
+
+from telnet_protocol import ANSI_PATTERN
+
+DIRECTIONS = {
+    'n': 'north', 'north': 'north',
+    's': 'south', 'south': 'south',
+    'e': 'east', 'east': 'east',
+    'w': 'west', 'west': 'west',
+    'u': 'up', 'up': 'up',
+    'd': 'down', 'down': 'down',
+    'ne': 'northeast', 'northeast': 'northeast',
+    'nw': 'northwest', 'northwest': 'northwest',
+    'se': 'southeast', 'southeast': 'southeast',
+    'sw': 'southwest', 'southwest': 'southwest',
+}
+OPPOSITE = {
+    'north': 'south', 'south': 'north', 'east': 'west', 'west': 'east', 'up': 'down', 'down': 'up',
+    'northeast': 'southwest', 'southwest': 'northeast', 'northwest': 'southeast', 'southeast': 'northwest',
+}
+SHORT = {'north': 'n', 'south': 's', 'east': 'e', 'west': 'w', 'up': 'u', 'down': 'd',
+         'northeast': 'ne', 'northwest': 'nw', 'southeast': 'se', 'southwest': 'sw'}
+
+EXITS_PATTERN = re.compile(r'^\s*\[\s*Exits?:\s*([^\]]*)\]', re.IGNORECASE)
+BLOCKED_PATTERN = re.compile(
+    r"^(?:Alas, you cannot go that way|The \w+ is closed|You are too exhausted|"
+    r"You can't do that while|You are (?:fighting|sleeping|resting)|No way!\s+You are still fighting|"
+    r"You need a boat)",
+    re.IGNORECASE,
+)
+PROMPT_PATTERN = re.compile(r'>>\s*$')
+TRAVEL_PATTERN = re.compile(r'^\s*travel\s+(?:to\s+)?(.+?)\s*$', re.IGNORECASE)
+
+# Commands that print the current room without moving
+LOOK_COMMANDS = {'look', 'l'}
+# Commands that move somewhere we cannot predict
+TELEPORT_COMMANDS = {'recall', 'enter'}
+
+
+def parse_direction(command):
+    """Return the full direction name for movement commands like 'n', 'go north' or 'walk ne'."""
+    words = command.strip().lower().split()
+    if len(words) == 2 and words[0] in ('go', 'walk'):
+        words = words[1:]
+    if len(words) == 1:
+        return DIRECTIONS.get(words[0])
+    return None
+
+
+def parse_exits(text):
+    exits = []
+    for word in re.split(r'[\s,]+', text.strip().lower()):
+        word = word.strip('()<>*')
+        if word in DIRECTIONS:
+            exits.append(DIRECTIONS[word])
+    return exits
+
+
+def is_room_name(line):
+    """Short and not ending like a sentence, a quote or a prompt."""
+    line = line.strip()
+    return bool(line) and len(line) <= 70 and not line.endswith(('.', '!', '?', '"', "'", '>>'))
+
+
+def find_room_name(lines, start, end):
+    """
+    Index of the room name among lines[start:end], the exits line being at
+    `end`: the nearest name-like line going back from the exits, so a tell or
+    a command echo before the room is not taken for its name. A line followed
+    by one starting in lower case is a wrapped description line. None if no
+    line qualifies.
+    """
+    for i in range(end - 1, start - 1, -1):
+        if not is_room_name(lines[i]):
+            continue
+        following = lines[i + 1].strip() if i + 1 < end else ''
+        if following[:1].islower():
+            continue
+        return i
+    return None
+
+
+def parse_screen(screen):
+    """
+    Return the movement-relevant events of a screen in order:
+    ('room', name, exits, description) for each room display, ('blocked', line)
+    for movement failures and ('prompt', line) for each game prompt, which ends
+    the reply to one command. A room's name is the last short line that does not
+    end like a sentence before its exits line (see find_room_name); the
+    description is the text between the name and the exits line.
+    """
+    lines = []
+    for line in ANSI_PATTERN.sub('', screen).splitlines():
+        # Output that follows a prompt on the same line starts a new block
+        if '>>' in line:
+            prompt, rest = line.rsplit('>>', 1)
+            lines.append(prompt + '>>')
+            line = rest
+        lines.append(line)
+    events = []
+    block_start = 0
+    for i, line in enumerate(lines):
+        if PROMPT_PATTERN.search(line):
+            events.append(('prompt', line.strip()))
+            block_start = i + 1
+            continue
+        stripped = line.strip()
+        if BLOCKED_PATTERN.search(stripped):
+            events.append(('blocked', stripped))
+            block_start = i + 1
+            continue
+        match = EXITS_PATTERN.match(line)
+        if not match:
+            continue
+        j = find_room_name(lines, block_start, i)
+        if j is not None:
+            description = ' '.join(' '.join(lines[j + 1:i]).split())
+            events.append(('room', lines[j].strip(), parse_exits(match.group(1)), description))
+        block_start = i + 1
+    return events
+
+
+def room_key(name, exits, description=''):
+    """
+    Rooms without a server room number are told apart by name, exits and a
+    fingerprint of their description. Identical rooms (a street of "Main Street")
+    still share this key; WorldMap tells those apart by how they connect.
+    """
+    digest = hashlib.sha1(description.lower().encode('utf-8')).hexdigest()[:8]
+    return f"{name}|{','.join(sorted(exits))}|{digest}"
+
+
+class WorldMap:
+    """
+    Room graph learned from the telnet stream and saved as JSON. Record each
+    command with sent() before its output arrives, then pass the output to
+    observe(); moves that lead from one parsed room to another become edges.
+    Each prompt ends the reply to one command, so a move whose reply showed
+    neither a room nor a failure we recognise is dropped at its prompt instead
+    of being paired with a later room.
+    Rooms are keyed by the server's room number when GMCP/MSDP sends one, and
+    otherwise by room_key() plus a '#n' suffix for look-alike rooms.
+    """
+
+    def __init__(self, path='world_map.json'):
+        self.path = path
+        self.rooms = {}
+        self.current = None
+        self._pending = collections.deque(maxlen=50)  # One entry per command sent, its reply not seen yet
+        self._answered = False  # Whether the current reply has consumed its command yet
+        self._dirty = False
+        self._saved_at = time.monotonic()
+        if path and os.path.exists(path):
+            try:
+                with open(path, 'r', encoding='utf-8') as f:
+                    self.rooms = json.load(f).get('rooms', {})
+            except (OSError, json.JSONDecodeError) as e:
+                print(f"[WARN] Could not load world map {path}: {e}")
+        self._lookalikes = collections.defaultdict(list)  # room_key() -> keys of rooms that share it
+        for key, room in self.rooms.items():
+            if room.get("base"):
+                self._lookalikes[room["base"]].append(key)
+
+    def sent(self, command):
+        parts = [part.strip() for part in (command or '').split('|')]
+        for part in [part for part in parts if part] or ['']:
+            direction = parse_direction(part)
+            if direction:
+                self._pending.append(direction)
+            elif part.lower() in LOOK_COMMANDS:
+                self._pending.append(None)
+            elif part.lower().split(' ')[0] in TELEPORT_COMMANDS:
+                self._pending.append('?')
+            else:
+                self._pending.append('')  # Not a move, but its reply still ends in a prompt
+
+    def observe(self, screen, room_id=None, room_name=None):
+        """
+        Update the graph from a screen and return its events (see parse_screen).
+        `room_id` is the server's number for the room we ended up in (GMCP/MSDP);
+        it is used for the screen's last room if `room_name`, when given, matches.
+        """
+        events = parse_screen(screen)
+        last_room = max((i for i, event in enumerate(events) if event[0] == 'room'), default=None)
+        for i, event in enumerate(events):
+            if event[0] == 'prompt':
+                if not self._answered and self._pending:
+                    self._pending.popleft()  # Its reply was neither a room nor a recognised failure
+                self._answered = False
+                continue
+            move = self._pending.popleft() if self._pending else None
+            self._answered = True
+            if event[0] == 'blocked':
+                continue
+            _, name, exits, description = event
+            if (i == last_room and room_id is not None
+                    and (not room_name or room_name.strip().lower() == name.lower())):
+                key = f"#{room_id}"
+                if key not in self.rooms:
+                    self.rooms[key] = {"name": name, "exits": {d: None for d in exits}}
+                    self._dirty = True
+            else:
+                key = self._resolve(room_key(name, exits, description), name, exits, move)
+            if key is None:
+                self.current = None  # One of several look-alike rooms; unknown until the next move
+                continue
+            if move and move != '?' and self.current in self.rooms:
+                self._link(self.current, move, key)
+            self.current = key
+        return events
+
+    def _resolve(self, base, name, exits, move):
+        """
+        The key of the room we arrived in after `move`, given its room_key(). A
+        known edge or a matching way back picks an existing look-alike; a move
+        into a look-alike that cannot be the room we came from adds a new one.
+        """
+        candidates = self._lookalikes.get(base, [])
+        came_from = self.current if self.current in self.rooms else None
+        known_move = move and move != '?'
+        if came_from and known_move:
+            nxt = self.rooms[came_from]["exits"].get(move)
+            if nxt in candidates:
+                return nxt
+            back = OPPOSITE.get(move)
+            for key in candidates:
+                way_back = self.rooms[key]["exits"].get(back)
+                if way_back == came_from or (way_back is None and key != came_from):
+                    return key
+        elif move is None and came_from in candidates:
+            return came_from  # 'look' or output without a move
+        elif len(candidates) == 1:
+            return candidates[0]
+        elif candidates:
+            return None
+        key = base if not candidates else f"{base}#{len(candidates) + 1}"
+        self.rooms[key] = {"name": name, "exits": {d: None for d in exits}, "base": base}
+        self._lookalikes[base].append(key)
+        self._dirty = True
+        return key
+
+    def _link(self, src, direction, dst):
+        exits = self.rooms[src]["exits"]
+        if exits.get(direction) != dst:
+            exits[direction] = dst
+            self._dirty = True
+        back = OPPOSITE.get(direction)
+        dst_exits = self.rooms[dst]["exits"]
+        if back in dst_exits and dst_exits[back] is None:
+            dst_exits[back] = src
+            self._dirty = True
+
+    def find_rooms(self, name):
+        """Keys of rooms whose name matches exactly, or else contains `name` (case-insensitive)."""
+        needle = name.strip().lower()
+        exact = [k for k, r in self.rooms.items() if r["name"].lower() == needle]
+        return exact or [k for k, r in self.rooms.items() if needle in r["name"].lower()]
+
+    def path_to(self, name):
+        """BFS over known edges to the nearest room matching `name`; a list of directions or None."""
+        if self.current not in self.rooms:
+            return None
+        targets = set(self.find_rooms(name))
+        if not targets:
+            return None
+        if self.current in targets:
+            return []
+        previous = {self.current: None}
+        queue = collections.deque([self.current])
+        while queue:
+            key = queue.popleft()
+            for direction, nxt in self.rooms[key]["exits"].items():
+                if nxt is None or nxt in previous or nxt not in self.rooms:
+                    continue
+                previous[nxt] = (key, direction)
+                if nxt in targets:
+                    path = []
+                    while previous[nxt] is not None:
+                        nxt, step = previous[nxt]
+                        path.append(step)
+                    return path[::-1]
+                queue.append(nxt)
+        return None
+
+    def current_name(self):
+        room = self.rooms.get(self.current)
+        return room["name"] if room else None
+
+    def save(self, force=False):
+        if not self.path or not (self._dirty or force):
+            return
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump({"rooms": self.rooms}, f, ensure_ascii=False)
+        os.replace(tmp_path, self.path)
+        self._dirty = False
+        self._saved_at = time.monotonic()
+
+    def save_if_due(self, interval=30.0):
+        if self._dirty and time.monotonic() - self._saved_at >= interval:
+            self.save()
+
+
+class Travel:
+    """
+    A `travel <room>` request being walked locally. update() is fed each
+    screen's events and returns None while still on the way, or a note for the
+    LLM once we arrive or the route turns out to be blocked. A step counts as
+    taken when a room or a failure shows up, or when a prompt ends a reply
+    with neither, so unrecognised output cannot leave the walk waiting forever.
+    """
+
+    def __init__(self, target, path):
+        self.target = target
+        self.path = path
+        self.steps_seen = 0
+        self._answered = False
+
+    def command(self):
+        return '|'.join(SHORT[d] for d in self.path)
+
+    def update(self, world, events):
+        for event in events:
+            if event[0] == 'prompt':
+                if not self._answered:
+                    self.steps_seen += 1
+                self._answered = False
+                continue
+            self.steps_seen += 1
+            self._answered = True
+            if event[0] == 'blocked':
+                return f"[travel] Route to {self.target} blocked at {world.current_name()}: {event[1]}"
+            if world.current in world.find_rooms(self.target):
+                return f"[travel] Arrived at {world.current_name()}."
+        if self.steps_seen >= len(self.path):
+            return f"[travel] Did not reach {self.target}; now at {world.current_name()}."
+        return None